@@ -1,228 +1,740 @@
+import gzip
+import json
+import logging
+import math
 import os
-import random
-from flask import Flask, request, jsonify
-from ortools.linear_solver import pywraplp
+from importlib import metadata
+import queue
+import threading
+import time
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from flask import Flask, Response, g, request, jsonify, stream_with_context
+from cache import ResultCache, cache_key
+from jobs import JobQueue, run_in_process
+from metrics import PhaseTimer, Registry
 
 app = Flask(__name__)
+started_at = time.time()
 
-def solve_holistic(fencers):
+# One JSON line per solve on stderr (collected by the platform log drain)
+log = logging.getLogger("solver")
+if not log.handlers:
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    log.addHandler(handler)
+    log.setLevel(os.environ.get("SOLVE_LOG_LEVEL", "INFO"))
+    log.propagate = False
+
+# MILP engines for the holistic model
+BACKENDS = ["scip", "cp-sat"]
+
+# Keys of solver.FORMULATIONS, listed here so requests are validated
+# without loading the solver
+FORMULATIONS = ["auto", "holistic", "aggregated", "decomposed", "lns"]
+
+# Seeded draws and alternative line-ups are built on the holistic SCIP model
+MAX_SOLUTIONS = int(os.environ.get("MAX_SOLUTIONS", 10))
+DRAW_OPTIONS = ["seed", "solutions", "solution_tolerance"]
+
+_solver = None
+
+def solver_module():
+    """
+    The solver engines, imported on first use. Importing OR-Tools and SciPy
+    takes most of a second, which health checks and request validation
+    should not wait for; gunicorn.conf.py warms it up right after a worker
+    boots.
+    """
+    global _solver
+    if _solver is None:
+        import solver
+        _solver = solver
+    return _solver
+
+def solve_request(formulation, fencers, options, on_incumbent=None, should_stop=None):
+    return solver_module().solve_request(formulation, fencers, options, on_incumbent, should_stop)
+
+def parse_previous(previous):
+    """
+    Validates the "teams" of an earlier response (or the response itself)
+    and returns a copy with every team's "reserves" filled in.
+    Raises ValueError unless every member is a {name, category, preference}
+    object under a weapon key, every reserve also names its weapon and team
+    numbers, where given, are positive integers.
+    """
+    if isinstance(previous, dict):
+        previous = previous.get("teams")
+    if not isinstance(previous, list):
+        raise ValueError("previous must be a teams result")
+
+    def is_fencer(entry, preference_type):
+        return (isinstance(entry, dict) and isinstance(entry.get("name"), str)
+                and isinstance(entry.get("category"), str) and isinstance(entry.get("preference"), preference_type)
+                and not isinstance(entry.get("preference"), bool))
+
+    teams = []
+    for k, team in enumerate(previous):
+        if not isinstance(team, dict) or not isinstance(team.get("members"), dict):
+            raise ValueError(f"previous team {k} must have a members object")
+        number = team.get("team", 1)
+        if isinstance(number, bool) or not isinstance(number, int) or number < 1:
+            raise ValueError(f"previous team {k} must have a positive integer team number")
+        for w_name, member in team["members"].items():
+            if w_name not in WEAPONS or not is_fencer(member, (int, float)):
+                raise ValueError(f"previous team {k} members must map weapons to name, category and preference")
+        reserves = team.get("reserves", [])
+        if not isinstance(reserves, list) or not all(
+            is_fencer(r, dict) and r.get("weapon") in WEAPONS for r in reserves
+        ):
+            raise ValueError(f"previous team {k} reserves must be fencers with a weapon")
+        teams.append(dict(team, reserves=reserves))
+    return teams
+
+def integer_option(data, key):
     """
-    Solves the team assignment problem using a single holistic MILP model.
-    Encodes constraints for:
-    - Team Size (3 Main)
-    - Roles (Main vs Reserve)
-    - Gender constraints (avoid 3M/3F, prefer 2F/1M or 1F/2M)
-    - Reserve Rules (Match 2F, Mismatch 1F, No 3M)
-    - Objective: Maximize preference (Minimize for All-M)
+    data[key] as an int. Integral floats are accepted; booleans, strings and
+    fractions raise ValueError instead of being coerced (True is not 1 ms).
     """
-    solver = pywraplp.Solver.CreateSolver("SCIP") # SCIP is better for non-linear logic / indicators
-    if not solver:
-        return {"error": "Solver not found"}
+    value = data[key]
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError(f"{key} must be an integer")
+    return value
+
+def parse_options(data):
+    """
+    Extracts the solver options of a request payload.
+    Raises ValueError on malformed values.
+    """
+    options = {}
+    if data.get("time_limit_ms") is not None:
+        options["time_limit_ms"] = integer_option(data, "time_limit_ms")
+        if options["time_limit_ms"] <= 0:
+            raise ValueError("time_limit_ms must be positive")
+    if data.get("relative_gap") is not None:
+        options["relative_gap"] = float(data["relative_gap"])
+        if not (math.isfinite(options["relative_gap"]) and 0 <= options["relative_gap"] < 1):
+            raise ValueError("relative_gap must be in [0, 1)")
+    if data.get("threads") is not None:
+        options["threads"] = integer_option(data, "threads")
+        if options["threads"] <= 0:
+            raise ValueError("threads must be positive")
+    if data.get("backend") is not None:
+        if data["backend"] not in BACKENDS:
+            raise ValueError(f"backend must be one of {', '.join(BACKENDS)}")
+        options["backend"] = data["backend"]
+    if data.get("previous") is not None:
+        options["previous"] = parse_previous(data["previous"])
+    if data.get("stability_weight") is not None:
+        options["stability_weight"] = float(data["stability_weight"])
+        if not (math.isfinite(options["stability_weight"]) and options["stability_weight"] >= 0):
+            raise ValueError("stability_weight must be a finite non-negative number")
+    if data.get("incremental") is not None:
+        options["incremental"] = bool(data["incremental"])
+    if data.get("neighbourhood_teams") is not None:
+        options["neighbourhood_teams"] = integer_option(data, "neighbourhood_teams")
+        if options["neighbourhood_teams"] < 0:
+            raise ValueError("neighbourhood_teams must be non-negative")
+    if data.get("seed") is not None:
+        options["seed"] = integer_option(data, "seed")
+        if options["seed"] < 0:
+            raise ValueError("seed must be non-negative")
+    if data.get("solutions") is not None:
+        options["solutions"] = integer_option(data, "solutions")
+        if not 1 <= options["solutions"] <= MAX_SOLUTIONS:
+            raise ValueError(f"solutions must be between 1 and {MAX_SOLUTIONS}")
+    if data.get("solution_tolerance") is not None:
+        options["solution_tolerance"] = float(data["solution_tolerance"])
+        if not (math.isfinite(options["solution_tolerance"]) and options["solution_tolerance"] >= 0):
+            raise ValueError("solution_tolerance must be a finite non-negative number")
+    return options
+
+# --- Input Validation ---
+# Entry lists are checked and normalised before the solver is loaded or a
+# model is built: malformed and provably infeasible lists are rejected in
+# the web process, with one error per offending field.
+WEAPONS = ["foil", "epee", "sabre"]
+MIN_PREFERENCE, MAX_PREFERENCE = 1, 5
+MAX_REPORTED_ERRORS = 100
+
+class InvalidEntries(ValueError):
+    """
+    A rejected entry list. errors lists {"index", "name", "field", "error"}
+    per problem; status is "INFEASIBLE" when the entries are well formed but
+    no line-up can satisfy the rules.
+    """
+
+    def __init__(self, message, errors=(), status=None):
+        super().__init__(message)
+        self.errors = list(errors)
+        self.status = status
+
+def error_body(e):
+    """JSON body of a rejected request."""
+    body = {"error": str(e)}
+    if getattr(e, "errors", None):
+        body["errors"] = e.errors[:MAX_REPORTED_ERRORS]
+    if getattr(e, "status", None):
+        body["status"] = e.status
+    return body
+
+def normalise_fencers(fencers):
+    """
+    Validates an entry list and returns it as compact {"name", "category",
+    "preference"} dicts: category "M" or "F" (any case on input), an integer
+    score from 1 to 5 for each of foil, epee and sabre, other keys dropped.
+    Raises InvalidEntries listing every bad field.
+    """
+    if not isinstance(fencers, list):
+        raise InvalidEntries("fencers must be a list")
+
+    errors = []
+    normalised = []
+    seen = {}
+    for i, f in enumerate(fencers):
+        if not isinstance(f, dict):
+            errors.append({"index": i, "name": None, "field": None, "error": "must be an object"})
+            continue
+        name = f.get("name")
+
+        def error(field, message):
+            errors.append({"index": i, "name": name if isinstance(name, str) else None,
+                           "field": field, "error": message})
 
-    # --- Data Prep ---
+        if not isinstance(name, str) or not name.strip():
+            error("name", "must be a non-empty string")
+        elif name in seen:
+            error("name", f"duplicate of entry {seen[name]}")
+        else:
+            seen[name] = i
+
+        category = f.get("category")
+        category = category.strip().upper() if isinstance(category, str) else category
+        if category not in ("M", "F"):
+            error("category", 'must be "M" or "F"')
+
+        preference = f.get("preference")
+        scores = {}
+        if not isinstance(preference, dict):
+            error("preference", "must be an object with foil, epee and sabre scores")
+        else:
+            for w in WEAPONS:
+                score = preference.get(w)
+                if isinstance(score, float) and score.is_integer():
+                    score = int(score)
+                if isinstance(score, bool) or not isinstance(score, int) or not MIN_PREFERENCE <= score <= MAX_PREFERENCE:
+                    error(f"preference.{w}", f"must be an integer from {MIN_PREFERENCE} to {MAX_PREFERENCE}")
+                scores[w] = score
+            for w in preference:
+                if w not in WEAPONS:
+                    error(f"preference.{w}", "unknown weapon")
+        normalised.append({"name": name, "category": category, "preference": scores})
+
+    if errors:
+        raise InvalidEntries(f"Invalid fencers: {len(errors)} problem(s) in the entry list", errors)
+    return normalised
+
+def check_feasible(fencers):
+    """
+    Rejects entry lists that no line-up can satisfy, without building a
+    model. Teams take 3 fencers and at most one reserve, and the len % 3
+    reserves each need a team with a female fencer (3M teams take no
+    reserve). Any list passing these checks has a feasible line-up.
+    """
     n_fencers = len(fencers)
-    n_teams = n_fencers // 3
+    n_teams, n_reserves = divmod(n_fencers, 3)
+    n_female = sum(1 for f in fencers if f["category"] == "F")
     if n_teams == 0:
-        return {"teams": [], "reserves": fencers} # Not enough for 1 team
-
-    weapons = ["foil", "epee", "sabre"]
-    n_weapons = 3
-
-    # --- Variables ---
-    # x[i, t, w, r]: 1 if fencer i is in team t with weapon w and role r (0=Main, 1=Reserve)
-    # i: 0..N-1
-    # t: 0..T-1
-    # w: 0..2
-    # r: 0..1
-    x = {}
-    for i in range(n_fencers):
-        for t in range(n_teams):
-            for w in range(n_weapons):
-                for r in range(2): # 0=Main, 1=Reserve
-                    x[i, t, w, r] = solver.BoolVar(f"x_{i}_{t}_{w}_{r}")
-
-    # Auxiliary: Gender composition of MAIN slots
-    # is_3m[t]: 1 if team t has 0 Females in Main
-    # is_1f[t]: 1 if team t has 1 Female in Main
-    # is_2f[t]: 1 if team t has 2 Females in Main
-    # is_3f[t]: 1 if team t has 3 Females in Main
-    is_3m = {t: solver.BoolVar(f"is_3m_{t}") for t in range(n_teams)}
-    is_1f = {t: solver.BoolVar(f"is_1f_{t}") for t in range(n_teams)}
-    is_2f = {t: solver.BoolVar(f"is_2f_{t}") for t in range(n_teams)}
-    is_3f = {t: solver.BoolVar(f"is_3f_{t}") for t in range(n_teams)}
-
-    # --- Hard Constraints ---
-
-    # 1. Every fencer assigned exactly once (Main OR Reserve)
-    for i in range(n_fencers):
-        solver.Add(
-            solver.Sum(x[i, t, w, r] for t in range(n_teams) for w in range(n_weapons) for r in range(2)) == 1
-        )
-
-    # 2. Team Composition: Main Slots
-    # Each team has exactly 1 Main Person per Weapon
-    for t in range(n_teams):
-        for w in range(n_weapons):
-            solver.Add(
-                solver.Sum(x[i, t, w, 0] for i in range(n_fencers)) == 1
-            )
-
-    # 3. Reserve Constraint
-    # Each team has AT MOST 1 Reserve (total across all weapons)
-    for t in range(n_teams):
-        solver.Add(
-            solver.Sum(x[i, t, w, 1] for i in range(n_fencers) for w in range(n_weapons)) <= 1
-        )
-    
-    # 4. Gender Classification Constraints (Indicators)
-    # Define N_F_Main[t]
-    for t in range(n_teams):
-        n_f_main = solver.Sum(
-            x[i, t, w, 0] for i in range(n_fencers) for w in range(n_weapons) 
-            if fencers[i]["category"].upper() == "F"
-        )
-        
-        # Link indicators: Strictly one is true
-        solver.Add(is_3m[t] + is_1f[t] + is_2f[t] + is_3f[t] == 1)
-        
-        # Logic: if is_3m=1, n_f_main=0.
-        # if is_1f=1, n_f_main=1.
-        # if is_2f=1, n_f_main=2.
-        # if is_3f=1, n_f_main=3.
-        # Implementation via linear bounds:
-        # n_f_main == 0*is_3m + 1*is_1f + 2*is_2f + 3*is_3f
-        solver.Add(n_f_main == (0 * is_3m[t] + 1 * is_1f[t] + 2 * is_2f[t] + 3 * is_3f[t]))
-
-    # 5. Reserve & Gender Interactions
-    
-    # 5a. NO Reserve on 3M Team
-    # Sum(Reserve in T) <= 1 - is_3m[t]
-    for t in range(n_teams):
-        reserve_count = solver.Sum(x[i, t, w, 1] for i in range(n_fencers) for w in range(n_weapons))
-        solver.Add(reserve_count <= 1 - is_3m[t])
-
-    # 5b. Reserve Matching Rules (For Male Reserves, primarily, but let's apply generally if sensible or strict for M)
-    # "If team has 2F... reserve M should have one of the 2F weapons"
-    # "If team has 1F... reserve M should NOT have the F weapon"
-    
-    for t in range(n_teams):
-        main_is_female_vars = []
-        for w in range(n_weapons):
-            var = solver.Sum(x[i, t, w, 0] for i in range(n_fencers) if fencers[i]["category"].upper() == "F")
-            main_is_female_vars.append(var) # value is 0 or 1 (since slot filled by 1 person)
-
-        for w_res in range(n_weapons):
-            # Sum of Male Reserves assigned to Team T with Weapon W_res
-            m_res_w = solver.Sum(x[i, t, w_res, 1] for i in range(n_fencers) if fencers[i]["category"].upper() == "M")
-            
-            # Constraint 1F: If is_1f[t]=1 AND m_res_w[t, w_res]=1 => main_is_female[t, w_res] MUST BE 0.
-            solver.Add(m_res_w + main_is_female_vars[w_res] <= 2 - is_1f[t])
-            
-            # Constraint 2F: If is_2f[t]=1 AND m_res_w[t, w_res]=1 => main_is_female[t, w_res] MUST BE 1.
-            solver.Add(m_res_w <= main_is_female_vars[w_res] + (1 - is_2f[t]))
-
-    # --- Objective Function ---
-    # Maximize sum of scores.
-    # Scores: prefs[w] (1-5).
-    # "Minimize" for 3M teams -> Contribution = -Score?
-    # Or Weight * -Score.
-    
-    obj_expr = 0
-    
-    # Penalties/Bonuses constants
-    P_3M = 1000 # Penalty for 3M team (try to avoid)
-    P_3F = 500  # Penalty for 3F team ("unless strictly necessary")
-    B_Res_2F = 200 # Bonus for assigning reserve to 2F team
-    
-    # Let valid_score(i, w) be fencer i's pref for w.
-    def get_score(i, w):
-        p = fencers[i]["preference"]
-        w_name = weapons[w]
-        return p.get(w_name, 1)
-
-    for t in range(n_teams):
-        # Add Team-level penalties
-        obj_expr -= P_3M * is_3m[t]
-        obj_expr -= P_3F * is_3f[t]
-        
-        # Add Bonus for 2F if it has a reserve
-        res_sum = solver.Sum(x[i, t, w, 1] for i in range(n_fencers) for w in range(n_weapons))
-        is_2f_res = solver.BoolVar(f"is_2f_res_{t}")
-        # Linearize: is_2f_res <= is_2f
-        solver.Add(is_2f_res <= is_2f[t])
-        # is_2f_res <= res_sum  (binary <= sum? if sum>1? sum is constrained <=1 from earlier).
-        solver.Add(is_2f_res <= res_sum)
-        # is_2f_res >= is_2f + res_sum - 1
-        solver.Add(is_2f_res >= is_2f[t] + res_sum - 1)
-        
-        obj_expr += B_Res_2F * is_2f_res
-        
-        # Individual Assignment Scores
-        for i in range(n_fencers):
-            for w in range(n_weapons):
-                for r in range(2): # Main and Reserve
-                    score = get_score(i, w)
-                    
-                    # We want: 
-                    # If is_3m[t] is 0: + score * x
-                    # If is_3m[t] is 1: - score * x  (Minimizing preference = Maximizing negative preference)
-                    
-                    # Let z[i,t,w,r] = x[i,t,w,r] AND is_3m[t]
-                    z = solver.BoolVar(f"z_{i}_{t}_{w}_{r}")
-                    solver.Add(z <= x[i, t, w, r])
-                    solver.Add(z <= is_3m[t])
-                    solver.Add(z >= x[i, t, w, r] + is_3m[t] - 1)
-                    
-                    # Term = score * (x - z)  +  (-score) * z
-                    #      = score * x - score * z - score * z
-                    #      = score * x - 2 * score * z
-                    
-                    # Note: For reserves on 3M, constraint ban means x=0, so z=0. Term 0. Correct.
-                    
-                    obj_expr += score * x[i, t, w, r]
-                    obj_expr -= 2 * score * z
-
-    solver.Maximize(obj_expr)
-
-    # --- Solve ---
-    status = solver.Solve()
-    
-    if status not in [pywraplp.Solver.OPTIMAL, pywraplp.Solver.FEASIBLE]:
-        return {"error": "No solution found"}
-
-    # --- Extract Results ---
-    teams_out = {}
-    for t in range(n_teams):
-        teams_out[t] = {"team": t+1, "members": {}, "reserves": []} # 1-indexed team ID
-    
-    for t in range(n_teams):
-        for i in range(n_fencers):
-            for w in range(n_weapons):
-                if x[i, t, w, 0].solution_value() > 0.5: # Main
-                    teams_out[t]["members"][weapons[w]] = {
-                        "name": fencers[i]["name"],
-                        "category": fencers[i]["category"],
-                        "preference": get_score(i, w) # Return scalar score
-                    }
-                if x[i, t, w, 1].solution_value() > 0.5: # Reserve
-                    # For reserve, we include the assigned weapon
-                    r_data = fencers[i].copy()
-                    r_data["weapon"] = weapons[w]
-                    r_data["preference"] = fencers[i]["preference"] # Keep dict
-                    teams_out[t]["reserves"].append(r_data)
-                    
-    # Format output list
-    result_list = [teams_out[t] for t in range(n_teams)]
-    return {"teams": result_list}
+        raise InvalidEntries(f"At least 3 fencers are needed to form a team, got {n_fencers}", status="INFEASIBLE")
+    if n_reserves > n_teams:
+        raise InvalidEntries(f"{n_fencers} fencers form {n_teams} team(s) with {n_reserves} reserves, "
+                             "but a team takes at most one reserve", status="INFEASIBLE")
+    if n_female < n_reserves:
+        raise InvalidEntries(f"{n_reserves} reserves need {n_reserves} teams with a female fencer, "
+                             f"but only {n_female} female fencer(s) are entered", status="INFEASIBLE")
+
+# --- Payload Formats ---
+# Large pools can be sent and returned as parallel arrays instead of one
+# object per fencer (COLUMNAR content type), and bodies can be gzipped both
+# ways. Plain JSON stays the default.
+COLUMNAR = "application/vnd.exiles.columnar+json"
+MAX_INFLATED_BYTES = int(os.environ.get("MAX_INFLATED_BYTES", 64 * 2 ** 20))
+GZIP_MIN_BYTES = 1024
+
+def request_payload():
+    """
+    JSON body of the request, inflated first when it is sent with
+    Content-Encoding: gzip. Raises ValueError on a bad or oversized body.
+    """
+    body = request.get_data()
+    if request.content_encoding == "gzip":
+        inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            body = inflater.decompress(body, MAX_INFLATED_BYTES)
+        except zlib.error:
+            raise ValueError("Invalid gzip body")
+        if inflater.unconsumed_tail:
+            raise ValueError(f"Request body inflates beyond {MAX_INFLATED_BYTES} bytes")
+    elif request.content_encoding not in (None, "identity"):
+        raise ValueError(f"Unsupported Content-Encoding: {request.content_encoding}")
+    try:
+        return json.loads(body)
+    except ValueError:
+        raise ValueError("Invalid input")
+
+def from_columnar(data):
+    """
+    Expands a columnar entry list into "fencers": "names", "categories"
+    (an array or a string such as "MFFM") and "preferences" (one
+    [foil, epee, sabre] row per fencer) of equal length. Other keys are
+    kept as options.
+    """
+    columns = {key: data.get(key) for key in ("names", "categories", "preferences")}
+    if not all(isinstance(v, (list, str) if k == "categories" else list) for k, v in columns.items()):
+        raise InvalidEntries("Columnar entry lists need names, categories and preferences arrays")
+    names, categories, preferences = columns.values()
+    if not len(names) == len(categories) == len(preferences):
+        raise InvalidEntries(f"names, categories and preferences differ in length "
+                             f"({len(names)}, {len(categories)}, {len(preferences)})")
+    errors = [
+        {"index": i, "name": names[i] if isinstance(names[i], str) else None, "field": "preferences",
+         "error": "must be a [foil, epee, sabre] row"}
+        for i, row in enumerate(preferences) if not isinstance(row, list) or len(row) != len(WEAPONS)
+    ]
+    if errors:
+        raise InvalidEntries(f"Invalid fencers: {len(errors)} problem(s) in the entry list", errors)
+    fencers = [{"name": name, "category": category, "preference": dict(zip(WEAPONS, row))}
+               for name, category, row in zip(names, categories, preferences)]
+    return dict({k: v for k, v in data.items() if k not in columns}, fencers=fencers)
+
+def to_columnar(result, fencers):
+    """
+    Replaces the teams of a result by "placements": team number, weapon
+    index (into "weapons") and role (0=Main, 1=Reserve) per fencer, in
+    entry-list order. Alternatives get the same treatment.
+    """
+    if "teams" not in result:
+        return result
+    index = {f["name"]: i for i, f in enumerate(fencers)}
+
+    def placements(teams):
+        team, weapon, role = [None] * len(fencers), [None] * len(fencers), [None] * len(fencers)
+        for t in teams:
+            for w_name, member in t["members"].items():
+                i = index[member["name"]]
+                team[i], weapon[i], role[i] = t["team"], WEAPONS.index(w_name), 0
+            for reserve in t["reserves"]:
+                i = index[reserve["name"]]
+                team[i], weapon[i], role[i] = t["team"], WEAPONS.index(reserve["weapon"]), 1
+        return {"team": team, "weapon": weapon, "role": role}
+
+    columnar = {k: v for k, v in result.items() if k not in ("teams", "alternatives")}
+    columnar.update(weapons=WEAPONS, placements=placements(result["teams"]))
+    if "alternatives" in result:
+        columnar["alternatives"] = [
+            dict({k: v for k, v in a.items() if k != "teams"}, placements=placements(a["teams"]))
+            for a in result["alternatives"]
+        ]
+    return columnar
+
+def wants_columnar():
+    """
+    True when the response should be columnar: the Accept header prefers
+    it, or the request itself was columnar and Accept leaves the choice open.
+    """
+    offers = [COLUMNAR, "application/json"] if request.mimetype == COLUMNAR else ["application/json", COLUMNAR]
+    return (request.accept_mimetypes.best_match(offers) or offers[0]) == COLUMNAR
+
+def parse_solve_request(data, columnar=False):
+    """
+    Validates a /solve style payload and returns (formulation, fencers,
+    options) with the entry list normalised by normalise_fencers; columnar
+    payloads are expanded by from_columnar first.
+    Raises ValueError with the message to return to the client
+    (InvalidEntries for entry list problems, see error_body).
+    """
+    if columnar and isinstance(data, dict) and "fencers" not in data:
+        data = from_columnar(data)
+    if not isinstance(data, dict) or "fencers" not in data:
+        raise ValueError("Invalid input")
+
+    formulation = data.get("formulation", "auto")
+    if formulation not in FORMULATIONS:
+        raise ValueError(f"Unknown formulation: {formulation}")
+
+    try:
+        options = parse_options(data)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid solver option: {e}")
+    if any(key in options for key in DRAW_OPTIONS):
+        if formulation not in ("auto", "holistic") or options.get("backend", "scip") != "scip":
+            raise ValueError("seed and solutions need the auto or holistic formulation with the scip backend")
+        if options.get("incremental"):
+            raise ValueError("seed and solutions cannot be combined with incremental")
+
+    fencers = normalise_fencers(data["fencers"])
+    check_feasible(fencers)
+    return formulation, fencers, options
+
+# --- Result Cache ---
+# Organisers re-run the sheet many times on a nearly unchanged entry list:
+# identical payloads (in any order) are answered without solving again.
+# Set CACHE_PATH to add an SQLite tier shared by all processes.
+result_cache = ResultCache(
+    max_entries=int(os.environ.get("CACHE_SIZE", 256)),
+    path=os.environ.get("CACHE_PATH"),
+    max_disk_entries=int(os.environ.get("CACHE_DISK_SIZE", 10000)),
+    ttl_s=float(os.environ.get("CACHE_TTL_S", 7 * 24 * 3600)),
+)
+
+# Default MILP time budget of /solve, stream and batch solves (see solver.py)
+SOLVE_TIME_LIMIT_MS = int(os.environ.get("SOLVE_TIME_LIMIT_MS", 25000))
+
+try:
+    SOLVER_VERSION = metadata.version("ortools")
+except metadata.PackageNotFoundError:
+    SOLVER_VERSION = None
+
+def request_cache_keys(formulation, fencers, options, time_limit_ms):
+    """
+    Cache keys of a request: (optimal, incumbent). An OPTIMAL result does not
+    depend on the time budget, so /solve, jobs and batches share its key.
+    Any other result is only the best line-up found in time_limit_ms, the
+    budget the solve ran with, and is reused only with that same budget.
+    """
+    options = {k: v for k, v in options.items() if k != "time_limit_ms"}
+    return (cache_key(fencers, formulation, options, SOLVER_VERSION),
+            cache_key(fencers, formulation, options, SOLVER_VERSION, time_limit_ms))
+
+def cached_result(args, time_limit_ms=SOLVE_TIME_LIMIT_MS):
+    """A cached OPTIMAL result, else an incumbent found with the same budget; time_limit_ms is the default budget."""
+    return result_cache.get(*request_cache_keys(*args, args[2].get("time_limit_ms", time_limit_ms)))
+
+def store_result(args, result, time_limit_ms=SOLVE_TIME_LIMIT_MS):
+    if "teams" in result:
+        optimal, incumbent = request_cache_keys(*args, args[2].get("time_limit_ms", time_limit_ms))
+        result_cache.put(optimal if result.get("status") == "OPTIMAL" else incumbent, result)
+
+# --- Instrumentation ---
+# Solves are recorded in the web process, including those that ran in a job
+# or batch child process, and exported in Prometheus text format on /metrics.
+registry = Registry()
+http_latency = registry.histogram(
+    "http_request_duration_seconds", "Time to build the response of an HTTP request.",
+    ["endpoint", "method", "code"])
+solve_count = registry.counter(
+    "solves_total", "Solves run (cache hits excluded) by source, formulation and final status.",
+    ["source", "formulation", "status"])
+solve_latency = registry.histogram(
+    "solve_phase_seconds", "Wall time of the solve phases (build, solve, extract) and of the whole solve.",
+    ["formulation", "phase"])
+
+def record_solve(source, args, result, wall_ms, **extra):
+    """Counts a finished solve, observes its phase timings and logs it as one JSON line."""
+    formulation, fencers, options = args
+    status = result.get("status", "ERROR")
+    stats = result.get("stats", {})
+    solve_count.inc(source, formulation, status)
+    for phase in ("build", "master", "solve", "extract"):
+        if f"{phase}_ms" in stats:
+            solve_latency.observe(stats[f"{phase}_ms"] / 1000, formulation, phase)
+    solve_latency.observe(wall_ms / 1000, formulation, "total")
+
+    line = {
+        "event": "solve", "source": source, "formulation": formulation,
+        "backend": options.get("backend", "scip"), "fencers": len(fencers), "status": status,
+        "objective": result.get("objective"), "bound": result.get("bound"), "gap": result.get("gap"),
+        "wall_ms": round(wall_ms, 1), **stats, **extra,
+    }
+    if "error" in result:
+        line["error"] = result["error"]
+    log.info(json.dumps(line))
+
+def job_done(args, state, result, wall_ms):
+    if state != "done":
+        # Cancelled jobs have no result
+        record_solve("job", args, dict(result or {}, status=state.upper()), wall_ms)
+        return
+    record_solve("job", args, result, wall_ms)
+    store_result(args, result, JOB_TIME_LIMIT_MS)
+
+# --- Asynchronous Jobs ---
+JOB_CONCURRENCY = int(os.environ.get("JOB_CONCURRENCY", 2))
+JOB_TIMEOUT_S = float(os.environ.get("JOB_TIMEOUT_S", 600))
+# Solver processes of jobs and batch items together, however many batches
+# are streaming at once: each one holds a slot while it runs
+SOLVER_PROCESSES = int(os.environ.get("SOLVER_PROCESSES", JOB_CONCURRENCY))
+solver_slots = threading.BoundedSemaphore(SOLVER_PROCESSES)
+# Lets the solver return its incumbent before the job is killed
+JOB_TIME_LIMIT_MS = int(JOB_TIMEOUT_S * 1000 * 0.9)
+
+def solve_job(formulation, fencers, options):
+    """
+    Runs a job's solve with JOB_TIME_LIMIT_MS unless the request sets a
+    time limit. The default is applied here rather than to the submitted
+    options, so an OPTIMAL job result shares its cache entry with /solve.
+    """
+    options = dict({"time_limit_ms": JOB_TIME_LIMIT_MS}, **options)
+    return solve_request(formulation, fencers, options)
+
+jobs = JobQueue(solve_job, concurrency=JOB_CONCURRENCY, timeout_s=JOB_TIMEOUT_S, on_done=job_done,
+                preload=["app", "solver"], slots=solver_slots)
+
+# --- Batch Solves ---
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", JOB_CONCURRENCY))
+MAX_BATCH_ITEMS = int(os.environ.get("MAX_BATCH_ITEMS", 100))
+
+def solve_batch_item(payload, columnar=False, columnar_result=False):
+    """
+    Solves one batch item in a child process; errors stay local to the item.
+    columnar / columnar_result: the item / its result use the columnar format.
+    """
+    try:
+        args = parse_solve_request(payload if isinstance(payload, dict) else None, columnar)
+    except ValueError as e:
+        return error_body(e)
+
+    result = cached_result(args)
+    if result is not None:
+        return {"result": to_columnar(result, args[1]) if columnar_result else result, "cached": True}
+    with solver_slots:
+        start = time.perf_counter()
+        state, result = run_in_process(solve_request, args, JOB_TIMEOUT_S)
+        wall_ms = 1000 * (time.perf_counter() - start)
+    if state != "done":
+        record_solve("batch", args, dict(result, status=state.upper()), wall_ms)
+        return {"error": result["error"]}
+    record_solve("batch", args, result, wall_ms)
+    store_result(args, result)
+    return {"result": to_columnar(result, args[1]) if columnar_result else result}
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def observe_request(response):
+    if "request_start" in g:
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        http_latency.observe(time.perf_counter() - g.request_start, endpoint, request.method, response.status_code)
+    return response
+
+@app.after_request
+def compress_response(response):
+    """Gzips buffered responses of GZIP_MIN_BYTES or more for clients that accept it."""
+    if (response.direct_passthrough or response.is_streamed or "Content-Encoding" in response.headers
+            or request.accept_encodings["gzip"] <= 0): # Quality 0 (e.g. "gzip;q=0") refuses gzip
+        return response
+    body = response.get_data()
+    if len(body) >= GZIP_MIN_BYTES:
+        response.set_data(gzip.compress(body, compresslevel=5))
+        response.headers["Content-Encoding"] = "gzip"
+        response.vary.add("Accept-Encoding")
+    return response
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """Liveness check; never loads the solver."""
+    return jsonify({"status": "ok", "solver_loaded": _solver is not None,
+                    "uptime_s": round(time.time() - started_at, 1)})
 
 @app.route('/solve', methods=['POST'])
 def solve_endpoint():
-    data = request.get_json()
-    if not data or "fencers" not in data:
+    """
+    Solves an entry list. The "stats" block of the response holds the
+    solver's phase timings and model size (send "stats": false to leave it
+    out); request parse and total time are in the Server-Timing header.
+    """
+    timer = PhaseTimer()
+    try:
+        data = request_payload()
+        formulation, fencers, options = parse_solve_request(data, request.mimetype == COLUMNAR)
+    except ValueError as e:
+        return jsonify(error_body(e)), 400
+    timer.lap("parse")
+
+    args = (formulation, fencers, options)
+    result = cached_result(args)
+    cache = "HIT" if result is not None else "MISS"
+    if result is None:
+        start = time.perf_counter()
+        result = solve_request(*args)
+        record_solve("solve", args, result, 1000 * (time.perf_counter() - start),
+                     parse_ms=timer.stats["parse_ms"])
+        store_result(args, result)
+    timer.lap("solve")
+
+    if data.get("stats") is False:
+        result = {k: v for k, v in result.items() if k != "stats"}
+    timing = f"parse;dur={timer.stats['parse_ms']}, solve;dur={timer.stats['solve_ms']}"
+    headers = {"X-Cache": cache, "Server-Timing": timing}
+    if wants_columnar():
+        return Response(json.dumps(to_columnar(result, fencers)), 200, headers, mimetype=COLUMNAR)
+    return jsonify(result), 200, headers
+
+# --- Progress Streaming ---
+# Seconds between keep-alive comments on an idle stream: they keep proxies
+# (Heroku closes connections idle for 55 s) from dropping long solves and
+# reveal a disconnected client, which stops the search.
+STREAM_KEEPALIVE_S = float(os.environ.get("STREAM_KEEPALIVE_S", 5))
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/solve/stream', methods=['POST'])
+def solve_stream():
+    """
+    /solve as Server-Sent Events: an "incumbent" event (elapsed_ms,
+    objective, bound, gap) for each improving solution the engine reports
+    (the cp-sat backend and lns), then a "result" event with the /solve
+    payload. Closing the stream stops those engines' search.
+    """
+    try:
+        data = request_payload()
+        args = parse_solve_request(data, request.mimetype == COLUMNAR)
+    except ValueError as e:
+        return jsonify(error_body(e)), 400
+    columnar = wants_columnar()
+
+    def generate():
+        result = cached_result(args)
+        if result is None:
+            events = queue.Queue()
+            stop = threading.Event()
+
+            def run():
+                start = time.perf_counter()
+                try:
+                    result = solve_request(*args, on_incumbent=lambda event: events.put(("incumbent", event)),
+                                           should_stop=stop.is_set)
+                except Exception as e:
+                    events.put(("error", {"error": f"{type(e).__name__}: {e}"}))
+                    raise
+                record_solve("stream", args, result, 1000 * (time.perf_counter() - start))
+                if not stop.is_set(): # A search cut short by the client is not cached
+                    store_result(args, result)
+                events.put(("result", result))
+
+            threading.Thread(target=run, name="solve-stream", daemon=True).start()
+            try:
+                while True:
+                    try:
+                        event, payload = events.get(timeout=STREAM_KEEPALIVE_S)
+                    except queue.Empty:
+                        yield ": keep-alive\n\n"
+                        continue
+                    if event == "incumbent":
+                        yield sse(event, payload)
+                    elif event == "error":
+                        yield sse(event, payload)
+                        return
+                    else:
+                        result = payload
+                        break
+            finally:
+                stop.set()
+
+        if data.get("stats") is False:
+            result = {k: v for k, v in result.items() if k != "stats"}
+        yield sse("result", to_columnar(result, args[1]) if columnar else result)
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route('/solve/batch', methods=['POST'])
+def solve_batch():
+    """
+    Solves a list of entry lists in parallel. Top-level keys other than
+    "items" are default options for every item. Results are streamed as
+    NDJSON, one {"index": k, "result"|"error": ...} line per item, in
+    completion order; an empty line is sent every STREAM_KEEPALIVE_S
+    seconds without a result, so the router does not drop the request.
+    """
+    try:
+        data = request_payload()
+    except ValueError as e:
+        return jsonify(error_body(e)), 400
+    if not isinstance(data, dict) or not isinstance(data.get("items"), list):
         return jsonify({"error": "Invalid input"}), 400
-    
-    result = solve_holistic(data["fencers"])
-    return jsonify(result)
+    if len(data["items"]) > MAX_BATCH_ITEMS:
+        return jsonify({"error": f"At most {MAX_BATCH_ITEMS} items per batch"}), 400
+
+    defaults = {k: v for k, v in data.items() if k != "items"}
+    items = [dict(defaults, **item) if isinstance(item, dict) else item for item in data["items"]]
+
+    columnar, columnar_result = request.mimetype == COLUMNAR, wants_columnar()
+
+    def generate():
+        with ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY) as pool:
+            futures = {pool.submit(solve_batch_item, item, columnar, columnar_result): k for k, item in enumerate(items)}
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, timeout=STREAM_KEEPALIVE_S, return_when=FIRST_COMPLETED)
+                if not done:
+                    yield "\n" # Keep-alive: an empty line between results
+                for future in done:
+                    yield json.dumps({"index": futures[future], **future.result()}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus scrape endpoint: request latency, solve counts and phase timings, cache and job gauges."""
+    cache = result_cache.stats()
+    extra = [
+        "# HELP solve_cache_lookups_total Result cache lookups by outcome.",
+        "# TYPE solve_cache_lookups_total counter",
+        f'solve_cache_lookups_total{{result="hit"}} {cache["hits"]}',
+        f'solve_cache_lookups_total{{result="miss"}} {cache["misses"]}',
+        "# HELP solve_cache_entries Results held in the in-memory cache.",
+        "# TYPE solve_cache_entries gauge",
+        f"solve_cache_entries {cache['memory_entries']}",
+        "# HELP solve_jobs Known asynchronous jobs by status.",
+        "# TYPE solve_jobs gauge",
+    ]
+    job_counts = jobs.counts()
+    for status in ("queued", "running", "done", "failed", "timeout", "cancelled"):
+        extra.append(f'solve_jobs{{status="{status}"}} {job_counts.get(status, 0)}')
+    return Response(registry.render(extra), mimetype="text/plain; version=0.0.4")
+
+@app.route('/cache', methods=['GET'])
+def cache_stats():
+    return jsonify(result_cache.stats())
+
+@app.route('/cache', methods=['DELETE'])
+def cache_clear():
+    result_cache.clear()
+    return jsonify(result_cache.stats())
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    try:
+        formulation, fencers, options = parse_solve_request(request_payload(), request.mimetype == COLUMNAR)
+    except ValueError as e:
+        return jsonify(error_body(e)), 400
+
+    result = cached_result((formulation, fencers, options), JOB_TIME_LIMIT_MS)
+    if result is not None:
+        job = jobs.submit_finished(result)
+    else:
+        job = jobs.submit(formulation, fencers, options)
+    return jsonify(job), 202, {"Location": f"/jobs/{job['id']}"}
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job)
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    job = jobs.cancel(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job)
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=8080)
@@ -0,0 +1,225 @@
+"""
+Benchmark harness for the team solver.
+
+Generates seeded synthetic entry lists across sizes, gender ratios and
+preference distributions, solves each with the selected engines in a fresh
+process and records build time, solve time, peak RSS, model size and
+objective in a JSON report:
+
+    python benchmark.py --sizes 12 48 150 --engines auto aggregated holistic
+    python benchmark.py --compare benchmark_report.json  # flag regressions
+    python benchmark.py --cold-start 5                   # web process startup
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+
+from jobs import run_in_process
+
+WEAPONS = ["foil", "epee", "sabre"]
+
+# engine name -> (formulation, extra options)
+ENGINES = {
+    "auto": ("auto", {}),
+    "holistic": ("holistic", {}),
+    "cp-sat": ("holistic", {"backend": "cp-sat"}),
+    "aggregated": ("aggregated", {}),
+    "decomposed": ("decomposed", {}),
+    "lns": ("lns", {}),
+}
+
+PREFERENCES = ["random", "specialist", "flat", "popular"]
+
+def generate_entries(n, female_ratio=0.4, preferences="random", seed=0):
+    """
+    Seeded synthetic entry list of n fencers.
+    preferences: "random" (1-5 uniform), "specialist" (one 5, others 1-2),
+    "flat" (all 3, maximal ties) or "popular" (most fencers favour foil).
+    """
+    rnd = random.Random(seed)
+    n_female = round(n * female_ratio)
+    categories = ["F"] * n_female + ["M"] * (n - n_female)
+    rnd.shuffle(categories)
+
+    fencers = []
+    for i, category in enumerate(categories):
+        if preferences == "random":
+            prefs = {w: rnd.randint(1, 5) for w in WEAPONS}
+        elif preferences == "specialist":
+            prefs = {w: rnd.randint(1, 2) for w in WEAPONS}
+            prefs[rnd.choice(WEAPONS)] = 5
+        elif preferences == "flat":
+            prefs = {w: 3 for w in WEAPONS}
+        elif preferences == "popular":
+            favourite = "foil" if rnd.random() < 0.7 else rnd.choice(WEAPONS)
+            prefs = {w: rnd.randint(1, 3) for w in WEAPONS}
+            prefs[favourite] = 5
+        else:
+            raise ValueError(f"Unknown preference distribution: {preferences}")
+        fencers.append({"name": f"Fencer {i + 1}", "category": category, "preference": prefs})
+    return fencers
+
+def measure(formulation, fencers, options):
+    """Runs one solve (in a child process) and returns its metrics."""
+    from solver import FORMULATIONS
+
+    start = time.perf_counter()
+    result = FORMULATIONS[formulation](fencers, options)
+    wall_ms = 1000 * (time.perf_counter() - start)
+    stats = result.get("stats", {})
+    return {
+        "status": result.get("status", "ERROR" if "error" in result else "OPTIMAL"),
+        "objective": result.get("objective"),
+        "bound": result.get("bound"),
+        "gap": result.get("gap"),
+        "wall_ms": round(wall_ms, 1),
+        "build_ms": stats.get("build_ms"),
+        "solve_ms": stats.get("solve_ms"),
+        "variables": stats.get("variables"),
+        "constraints": stats.get("constraints"),
+        # ru_maxrss is in KiB on Linux and bytes on macOS
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                             / (2 ** 20 if sys.platform == "darwin" else 2 ** 10), 1),
+    }
+
+def run_benchmark(sizes, ratios, preferences, engines, seeds, time_limit_ms, timeout_s=None, log=None):
+    runs = []
+    for n in sizes:
+        for female_ratio in ratios:
+            for prefs in preferences:
+                for seed in seeds:
+                    fencers = generate_entries(n, female_ratio, prefs, seed)
+                    for engine in engines:
+                        formulation, extra = ENGINES[engine]
+                        options = dict(extra, time_limit_ms=time_limit_ms)
+                        timeout = timeout_s or time_limit_ms / 1000 * 2 + 30
+                        state, metrics = run_in_process(measure, (formulation, fencers, options), timeout)
+                        if state != "done":
+                            metrics = {"status": state.upper(), "error": (metrics or {}).get("error")}
+                        run = {"engine": engine, "n": n, "female_ratio": female_ratio,
+                               "preferences": prefs, "seed": seed, **metrics}
+                        runs.append(run)
+                        if log:
+                            log(run)
+    return runs
+
+# Runs in a fresh interpreter: times importing the app, the first health
+# check and the first solve (which loads the solver engines)
+COLD_START_SCRIPT = """
+import json, resource, sys, time
+start = time.perf_counter()
+def lap():
+    return round(1000 * (time.perf_counter() - start), 1)
+def rss_mb():
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2 ** 20 if sys.platform == "darwin" else 2 ** 10), 1)
+from app import app
+report = {"import_ms": lap(), "import_rss_mb": rss_mb()}
+client = app.test_client()
+client.get("/healthz")
+report["first_healthz_ms"] = lap()
+fencers = [{"name": f"P{i}", "category": "MF"[i % 2], "preference": {"foil": i % 5 + 1, "epee": 3, "sabre": 1}} for i in range(9)]
+client.post("/solve", json={"fencers": fencers, "formulation": "holistic"})
+report["first_solve_ms"] = lap()
+report["solve_rss_mb"] = rss_mb()
+print(json.dumps(report))
+"""
+
+def cold_start(repeats=5):
+    """Startup cost of the web process over `repeats` fresh interpreters."""
+    samples = []
+    for _ in range(repeats):
+        out = subprocess.run([sys.executable, "-c", COLD_START_SCRIPT], capture_output=True, text=True, check=True,
+                             env=dict(os.environ, SOLVE_LOG_LEVEL="WARNING"))
+        samples.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return {key: sorted(s[key] for s in samples)[len(samples) // 2] for key in samples[0]} # Medians
+
+def compare(runs, baseline, slowdown=1.5, min_ms=50):
+    """
+    Regressions against a previous report: runs that got slower than
+    `slowdown` times the baseline (ignoring runs under min_ms), found a
+    worse objective, or lost a status they used to reach.
+    """
+    def key(run):
+        return (run["engine"], run["n"], run["female_ratio"], run["preferences"], run["seed"])
+
+    before = {key(run): run for run in baseline}
+    regressions = []
+    for run in runs:
+        old = before.get(key(run))
+        if old is None:
+            continue
+        reasons = []
+        if run.get("wall_ms") and old.get("wall_ms") and run["wall_ms"] > max(min_ms, slowdown * old["wall_ms"]):
+            reasons.append(f"wall time {old['wall_ms']} -> {run['wall_ms']} ms")
+        if run.get("objective") is not None and old.get("objective") is not None and run["objective"] < old["objective"] - 1e-6:
+            reasons.append(f"objective {old['objective']} -> {run['objective']}")
+        if old.get("status") == "OPTIMAL" and run.get("status") != "OPTIMAL":
+            reasons.append(f"status {old['status']} -> {run.get('status')}")
+        if reasons:
+            regressions.append({"run": key(run), "reasons": reasons})
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[12, 24, 48, 96, 150, 300, 600])
+    parser.add_argument("--ratios", type=float, nargs="+", default=[0.5, 0.3, 0.15],
+                        help="female ratios; 0.15 forces 3M teams at every size")
+    parser.add_argument("--preferences", nargs="+", choices=PREFERENCES, default=["random", "specialist"])
+    parser.add_argument("--engines", nargs="+", choices=list(ENGINES), default=["auto", "aggregated", "holistic"])
+    parser.add_argument("--seeds", type=int, nargs="+", default=[0])
+    parser.add_argument("--time-limit-ms", type=int, default=20000)
+    parser.add_argument("--output", default="benchmark_report.json")
+    parser.add_argument("--compare", help="previous report to check for regressions")
+    parser.add_argument("--cold-start", type=int, metavar="N",
+                        help="only measure web process startup (median of N fresh interpreters)")
+    args = parser.parse_args(argv)
+
+    if args.cold_start:
+        report = cold_start(args.cold_start)
+        for key, value in report.items():
+            print(f"{key:<18}{value:>10}")
+        return 0
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["runs"]
+
+    header = f"{'engine':<11}{'n':>5}{'F%':>5}{'prefs':>11}{'status':>11}{'objective':>11}{'build_ms':>10}{'solve_ms':>10}{'rss_mb':>8}{'vars':>9}"
+    print(header)
+
+    def log(run):
+        def fmt(value):
+            return "-" if value is None else value
+        print(f"{run['engine']:<11}{run['n']:>5}{round(100 * run['female_ratio']):>5}{run['preferences']:>11}"
+              f"{run['status']:>11}{fmt(run.get('objective')):>11}{fmt(run.get('build_ms')):>10}"
+              f"{fmt(run.get('solve_ms')):>10}{fmt(run.get('peak_rss_mb')):>8}{fmt(run.get('variables')):>9}", flush=True)
+
+    runs = run_benchmark(args.sizes, args.ratios, args.preferences, args.engines, args.seeds, args.time_limit_ms, log=log)
+    report = {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "time_limit_ms": args.time_limit_ms,
+        },
+        "runs": runs,
+    }
+    if baseline is not None:
+        report["regressions"] = compare(runs, baseline)
+        for regression in report["regressions"]:
+            print("REGRESSION", regression["run"], "; ".join(regression["reasons"]))
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {args.output}")
+    return 1 if report.get("regressions") else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,128 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import closing
+
+# Part of every key. The SQLite tier survives restarts: bump this whenever a
+# solver change alters results, so entries of an earlier deploy are not served.
+CACHE_VERSION = 2
+
+def cache_key(fencers, *extra):
+    """
+    Canonical hash of an entry list and its solver settings.
+    Fencers are sorted, so reordering the entry list hits the same entry.
+    """
+    canonical = sorted(json.dumps(f, sort_keys=True) for f in fencers)
+    payload = json.dumps([CACHE_VERSION, canonical, extra], sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class ResultCache:
+    """
+    Two-tier cache of solve results.
+    An in-memory LRU serves repeated requests within a process; an optional
+    SQLite file is shared by all processes on the machine (web worker and job
+    processes) and survives restarts. Both tiers expire entries after ttl_s.
+    """
+
+    def __init__(self, max_entries=256, path=None, max_disk_entries=10000, ttl_s=7 * 24 * 3600):
+        self.max_entries = max_entries
+        self.path = path
+        self.max_disk_entries = max_disk_entries
+        self.ttl_s = ttl_s
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0}
+        if path:
+            with closing(self._connect()) as conn, conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS results ("
+                    "key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+                )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=5)
+
+    def get(self, *keys):
+        """The value of the first of keys that holds a fresh entry; one lookup in the counters."""
+        now = time.time()
+        with self._lock:
+            for key in keys:
+                entry = self._memory.get(key)
+                if entry is not None and now - entry[0] <= self.ttl_s:
+                    self._memory.move_to_end(key)
+                    self._count("hits", "memory_hits")
+                    return entry[1]
+                self._memory.pop(key, None)
+
+        for key in keys if self.path else ():
+            value = self._disk_get(key, now)
+            if value is not None:
+                with self._lock:
+                    self._count("hits", "disk_hits")
+                    self._memory_put(key, value, now)
+                return value
+        with self._lock:
+            self._count("misses")
+        return None
+
+    def put(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._memory_put(key, value, now)
+            self._count("stores")
+        if self.path:
+            self._disk_put(key, value, now)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        if self.path:
+            with closing(self._connect()) as conn, conn:
+                conn.execute("DELETE FROM results")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters, memory_entries=len(self._memory), max_entries=self.max_entries)
+        if self.path:
+            with closing(self._connect()) as conn, conn:
+                stats["disk_entries"] = conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    def _count(self, *names):
+        for name in names:
+            self.counters[name] += 1
+
+    def _memory_put(self, key, value, now):
+        self._memory[key] = (now, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _disk_get(self, key, now):
+        with closing(self._connect()) as conn, conn:
+            row = conn.execute(
+                "SELECT value FROM results WHERE key = ? AND created >= ?", (key, now - self.ttl_s)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE results SET accessed = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def _disk_put(self, key, value, now):
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now, now),
+            )
+            conn.execute("DELETE FROM results WHERE created < ?", (now - self.ttl_s,))
+            conn.execute(
+                "DELETE FROM results WHERE key NOT IN "
+                "(SELECT key FROM results ORDER BY accessed DESC LIMIT ?)",
+                (self.max_disk_entries,),
+            )
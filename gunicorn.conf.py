@@ -0,0 +1,26 @@
+import os
+import threading
+
+# The job queue, result cache counters and metrics live in the web process,
+# so the app runs as one threaded worker by default (see README)
+workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
+# gthread serves `threads` requests per worker; sync serves one at a time
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 30))
+
+# PRELOAD_SOLVER=1 imports the app and the solver engines once in the master
+# so forked workers share those pages; worth it with several workers. By
+# default each worker starts serving right away (health checks, validation)
+# and imports the solver in the background just after booting.
+preload_app = os.environ.get("PRELOAD_SOLVER") == "1"
+
+def on_starting(server):
+    if preload_app:
+        from app import solver_module
+        solver_module()
+
+def post_worker_init(worker):
+    if not preload_app:
+        from app import solver_module
+        threading.Thread(target=solver_module, name="solver-warmup", daemon=True).start()
@@ -0,0 +1,167 @@
+import multiprocessing
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# forkserver children start from a clean process, which is safe to use from a
+# threaded web server and cheap once the solver module has been preloaded
+_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+def _run_in_child(conn, func, args):
+    try:
+        conn.send(("done", func(*args)))
+    except Exception as e:
+        conn.send(("failed", {"error": f"{type(e).__name__}: {e}"}))
+    finally:
+        conn.close()
+
+def run_in_process(func, args, timeout_s=None, should_stop=None, ctx=None):
+    """
+    Runs func(*args) in a child process and returns (state, result).
+    state is "done", "failed", "timeout" or "cancelled"; the child is killed
+    when the timeout expires or should_stop() becomes true.
+    """
+    ctx = ctx or multiprocessing.get_context(_START_METHOD)
+    parent_conn, child_conn = ctx.Pipe(duplex=False)
+    process = ctx.Process(target=_run_in_child, args=(child_conn, func, args), daemon=True)
+    process.start()
+    child_conn.close()
+    deadline = None if timeout_s is None else time.monotonic() + timeout_s
+    try:
+        while True:
+            if parent_conn.poll(0.1):
+                try:
+                    return parent_conn.recv()
+                except EOFError:
+                    return "failed", {"error": "Solver process exited unexpectedly"}
+            if should_stop is not None and should_stop():
+                return "cancelled", None
+            if deadline is not None and time.monotonic() > deadline:
+                return "timeout", {"error": "Job timed out"}
+            if not process.is_alive() and not parent_conn.poll():
+                return "failed", {"error": "Solver process exited unexpectedly"}
+    finally:
+        if process.is_alive():
+            process.terminate()
+        process.join()
+        parent_conn.close()
+
+class JobQueue:
+    """
+    In-memory registry of asynchronous solve jobs.
+    Each job runs in its own child process so a slow solve never blocks a web
+    worker and can be killed on cancel or timeout. At most `concurrency`
+    processes run at once; later jobs wait in the queue. A shared `slots`
+    semaphore also counts other child processes (e.g. batch solves) against
+    the limit; a job waiting for a slot stays queued. Job state lives in
+    the web process, so the app should be served by a single (threaded)
+    gunicorn worker when the job API is used. on_done(args, state, result,
+    elapsed_ms) is called in the web process after each job that ran, whatever
+    its final state; result is None for a cancelled job.
+    """
+
+    def __init__(self, func, concurrency=2, timeout_s=600, max_finished=1000, on_done=None, preload=None, slots=None):
+        self.func = func
+        self.slots = slots or threading.BoundedSemaphore(concurrency)
+        self.on_done = on_done
+        self.concurrency = concurrency
+        self.timeout_s = timeout_s
+        self.max_finished = max_finished
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="solve-job")
+        self._ctx = multiprocessing.get_context(_START_METHOD)
+        # Modules imported once by the fork server instead of by every job
+        preload = preload or ([func.__module__] if func.__module__ != "__main__" else [])
+        if _START_METHOD == "forkserver" and preload:
+            self._ctx.set_forkserver_preload(preload)
+        self._jobs = {}
+        self._stop = {}
+        self._lock = threading.Lock()
+
+    def submit(self, *args):
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._jobs[job_id] = {"id": job_id, "status": "queued", "submitted_at": time.time()}
+            self._stop[job_id] = threading.Event()
+            self._evict_finished()
+        self._executor.submit(self._run, job_id, args)
+        return self.get(job_id)
+
+    def submit_finished(self, result):
+        """Registers a job whose result is already known (e.g. from a cache)."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._jobs[job_id] = {
+                "id": job_id, "status": "done", "submitted_at": now,
+                "started_at": now, "finished_at": now, "result": result,
+            }
+            self._evict_finished()
+        return self.get(job_id)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job = dict(job)
+        if job["status"] == "queued":
+            job["queue_position"] = self._queue_position(job_id)
+        if "started_at" in job:
+            job["elapsed_ms"] = round(1000 * (job.get("finished_at", time.time()) - job["started_at"]))
+        return job
+
+    def cancel(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if job["status"] in ("queued", "running"):
+                self._stop[job_id].set()
+                if job["status"] == "queued":
+                    self._finish(job, "cancelled")
+        return self.get(job_id)
+
+    def counts(self):
+        """Number of known jobs per status."""
+        counts = {}
+        with self._lock:
+            for job in self._jobs.values():
+                counts[job["status"]] = counts.get(job["status"], 0) + 1
+        return counts
+
+    def _run(self, job_id, args):
+        with self.slots:
+            with self._lock:
+                job = self._jobs.get(job_id)
+                stop = self._stop.get(job_id)
+                if job is None or stop is None or stop.is_set():
+                    return
+                job["status"] = "running"
+                job["started_at"] = time.time()
+
+            state, result = run_in_process(self.func, args, self.timeout_s, stop.is_set, self._ctx)
+
+        with self._lock:
+            if result is not None:
+                job["result"] = result
+            self._finish(job, state)
+            elapsed_ms = 1000 * (job["finished_at"] - job["started_at"])
+        if self.on_done is not None:
+            self.on_done(args, state, result, elapsed_ms)
+
+    def _finish(self, job, state):
+        job["status"] = state
+        job["finished_at"] = time.time()
+        self._stop.pop(job["id"], None)
+
+    def _queue_position(self, job_id):
+        with self._lock:
+            queued = [j["id"] for j in self._jobs.values() if j["status"] == "queued"]
+        return queued.index(job_id) + 1 if job_id in queued else None
+
+    def _evict_finished(self):
+        finished = [j for j in self._jobs.values() if "finished_at" in j]
+        finished.sort(key=lambda j: j["finished_at"])
+        for job in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job["id"]]
@@ -0,0 +1,293 @@
+"""
+Load-test harness for the gunicorn deployment.
+
+Starts gunicorn (with gunicorn.conf.py) for every combination of worker
+class, worker count and threads, replays a weighted mix of seeded synthetic
+entry lists against /solve at each concurrency level and records
+throughput, p50/p95/p99 latency and peak RSS per worker process in a JSON
+report:
+
+    python loadtest.py --workers 1 2 --threads 1 8 --concurrency 1 4 8
+    python loadtest.py --worker-classes sync gthread --solver-threads 0 1 2
+    python loadtest.py --mix 12:3 48:1:0.15 24:1:0.4:holistic --requests 100 --preload
+"""
+import argparse
+import itertools
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmark import generate_entries
+
+# size:weight[:female_ratio[:formulation]]. Most events are club-sized and
+# gender-balanced, which auto solves with the min-cost flow fast path; the
+# holistic and female-scarce entries keep SCIP under load.
+DEFAULT_MIX = ["12:4", "24:3", "48:2", "96:1", "12:2:0.4:holistic", "24:2:0.4:holistic", "12:1:0.15"]
+
+def parse_mix(mix, female_ratio=0.4, formulation="auto"):
+    """
+    ["12:3", "48:1:0.15:holistic"] -> [(12, 3.0, 0.4, "auto"), (48, 1.0, 0.15, "holistic")]
+    Entries without a female ratio or formulation take the given defaults.
+    """
+    entries = []
+    for item in mix:
+        fields = item.split(":")
+        if not 2 <= len(fields) <= 4:
+            raise ValueError(f"Mix entries are size:weight[:female_ratio[:formulation]], got {item}")
+        fields += [female_ratio, formulation][len(fields) - 2:]
+        entries.append((int(fields[0]), float(fields[1]), float(fields[2]), fields[3]))
+    return entries
+
+def percentile(values, q):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+def process_rss_mb(pid):
+    """Resident set size of a process from /proc, in MB; None when it is gone or /proc is missing."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+def child_pids(pid):
+    """Direct children of a process (the gunicorn workers of a master), from /proc."""
+    children = []
+    for entry in os.listdir("/proc") if os.path.isdir("/proc") else []:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # The command name may contain spaces: the parent pid is the second field after it
+        if int(stat.rsplit(")", 1)[1].split()[1]) == pid:
+            children.append(int(entry))
+    return children
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_server(worker_class, workers, threads, preload=False, timeout_s=60):
+    """Starts gunicorn on a free local port and returns (process, base url) once /healthz answers."""
+    root = os.path.dirname(os.path.abspath(__file__))
+    gunicorn = shutil.which("gunicorn", path=os.path.dirname(sys.executable)) or shutil.which("gunicorn")
+    port = free_port()
+    env = dict(os.environ, GUNICORN_WORKER_CLASS=worker_class, WEB_CONCURRENCY=str(workers),
+               GUNICORN_THREADS=str(threads), PRELOAD_SOLVER="1" if preload else "0",
+               CACHE_SIZE="0", SOLVE_LOG_LEVEL="WARNING") # Measure solves, not cache hits
+    env.pop("CACHE_PATH", None)
+    process = subprocess.Popen([gunicorn, "app:app", "--config", "gunicorn.conf.py", "--bind", f"127.0.0.1:{port}"],
+                               cwd=root, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with status {process.returncode}")
+        try:
+            with urllib.request.urlopen(url + "/healthz", timeout=1):
+                return process, url
+        except OSError:
+            time.sleep(0.1)
+    stop_server(process)
+    raise RuntimeError("gunicorn did not answer /healthz in time")
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+def post_solve(url, body, timeout_s):
+    """
+    Sends one /solve request and returns (latency in ms, whether it
+    returned teams, whether a MILP model was built for it).
+    """
+    start = time.perf_counter()
+    request = urllib.request.Request(url + "/solve", data=body, headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout_s) as response:
+            result = json.loads(response.read())
+    except (OSError, ValueError): # HTTP errors, timeouts, refused connections, bad bodies
+        result = {}
+    # The flow fast path reports no model size
+    return 1000 * (time.perf_counter() - start), "teams" in result, "variables" in result.get("stats", {})
+
+class RssSampler:
+    """Samples the RSS of a gunicorn master and its workers in the background and keeps the peaks."""
+
+    def __init__(self, master_pid, interval_s=0.25):
+        self.master_pid, self.interval_s = master_pid, interval_s
+        self.peaks = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            for pid in [self.master_pid] + child_pids(self.master_pid):
+                rss = process_rss_mb(pid)
+                if rss is not None:
+                    self.peaks[pid] = max(rss, self.peaks.get(pid, 0))
+            if self._stop.wait(self.interval_s):
+                return
+
+def run_load(url, mix, concurrency, n_requests, options, seed=0, timeout_s=120):
+    """
+    Replays n_requests entry lists drawn from the parse_mix entries with
+    `concurrency` clients in a closed loop. Every list is distinct, so
+    nothing is answered from a cache. milp_share is the fraction of
+    requests that built a MILP model rather than taking the flow fast path.
+    """
+    rnd = random.Random(seed)
+    bodies = []
+    for k, (n, _, female_ratio, formulation) in enumerate(rnd.choices(mix, [entry[1] for entry in mix], k=n_requests)):
+        fencers = generate_entries(n, female_ratio, seed=seed * 1000003 + k)
+        bodies.append(json.dumps({"fencers": fencers, "formulation": formulation, **options}).encode())
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda body: post_solve(url, body, timeout_s), bodies))
+    wall_s = time.perf_counter() - start
+
+    latencies = [ms for ms, ok, _ in results if ok]
+    run = {"requests": n_requests, "errors": n_requests - len(latencies),
+           "milp_share": round(sum(milp for _, _, milp in results) / n_requests, 2),
+           "throughput_rps": round(len(latencies) / wall_s, 2)}
+    for q in (50, 95, 99):
+        run[f"p{q}_ms"] = round(percentile(latencies, q), 1) if latencies else None
+    run["max_ms"] = round(max(latencies), 1) if latencies else None
+    return run
+
+def run_config(worker_class, workers, threads, solver_threads, concurrencies, mix, n_requests,
+               time_limit_ms, preload=False, seed=0, log=None):
+    """Measures one gunicorn configuration at each concurrency level."""
+    options = {"time_limit_ms": time_limit_ms}
+    if solver_threads:
+        options["threads"] = solver_threads
+    config = {"worker_class": worker_class, "workers": workers, "threads": threads,
+              "solver_threads": solver_threads, "preload": preload}
+    process, url = start_server(worker_class, workers, threads, preload)
+    runs = []
+    try:
+        # Warm up every worker (solver import, first model) before measuring
+        run_load(url, [(9, 1, 0.4, "auto")], workers * threads, 2 * workers * threads, options, seed=seed + 999)
+        for concurrency in concurrencies:
+            with RssSampler(process.pid) as sampler:
+                run = run_load(url, mix, concurrency, n_requests, options, seed=seed,
+                               timeout_s=2 * time_limit_ms / 1000 + 30)
+            worker_rss = [rss for pid, rss in sorted(sampler.peaks.items()) if pid != process.pid]
+            run = {**config, "concurrency": concurrency, **run,
+                   "master_rss_mb": sampler.peaks.get(process.pid), "worker_rss_mb": worker_rss}
+            runs.append(run)
+            if log:
+                log(run)
+    finally:
+        stop_server(process)
+    return runs
+
+def best_configs(runs):
+    """Per concurrency level, the error-free configuration with the highest throughput."""
+    best = {}
+    for run in runs:
+        if run["errors"]:
+            continue
+        current = best.get(run["concurrency"])
+        if current is None or (run["throughput_rps"], -run["p95_ms"]) > (current["throughput_rps"], -current["p95_ms"]):
+            best[run["concurrency"]] = run
+    return [best[c] for c in sorted(best)]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--worker-classes", nargs="+", choices=["gthread", "sync"], default=["gthread"],
+                        help="sync workers serve one request at a time (--threads is ignored)")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2])
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--solver-threads", type=int, nargs="+", default=[0],
+                        help="threads option sent with each solve; 0 leaves the solver default")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--mix", nargs="+", default=DEFAULT_MIX,
+                        help="entry lists to replay, size:weight[:female_ratio[:formulation]]")
+    parser.add_argument("--female-ratio", type=float, default=0.4, help="for mix entries that do not set one")
+    parser.add_argument("--formulation", default="auto", help="for mix entries that do not set one")
+    parser.add_argument("--requests", type=int, default=40, help="requests per configuration and concurrency level")
+    parser.add_argument("--time-limit-ms", type=int, default=10000)
+    parser.add_argument("--preload", action="store_true", help="import the solver in the gunicorn master (PRELOAD_SOLVER=1)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="loadtest_report.json")
+    args = parser.parse_args(argv)
+
+    mix = parse_mix(args.mix, args.female_ratio, args.formulation)
+    configs = []
+    for worker_class, workers, threads, solver_threads in itertools.product(
+            args.worker_classes, args.workers, args.threads, args.solver_threads):
+        config = (worker_class, workers, 1 if worker_class == "sync" else threads, solver_threads)
+        if config not in configs:
+            configs.append(config)
+
+    header = f"{'class':<8}{'workers':>8}{'threads':>8}{'solver':>7}{'conc':>6}{'req/s':>8}{'p50_ms':>9}{'p95_ms':>9}{'p99_ms':>9}{'errors':>7}{'milp':>6}{'worker_rss_mb':>15}"
+    print(header)
+
+    def log(run):
+        def fmt(value):
+            return "-" if value is None else value
+        rss = max(run["worker_rss_mb"]) if run["worker_rss_mb"] else None
+        print(f"{run['worker_class']:<8}{run['workers']:>8}{run['threads']:>8}{run['solver_threads'] or '-':>7}"
+              f"{run['concurrency']:>6}{run['throughput_rps']:>8}{fmt(run['p50_ms']):>9}{fmt(run['p95_ms']):>9}"
+              f"{fmt(run['p99_ms']):>9}{run['errors']:>7}{run['milp_share']:>6}{fmt(rss):>15}", flush=True)
+
+    runs = []
+    for worker_class, workers, threads, solver_threads in configs:
+        runs += run_config(worker_class, workers, threads, solver_threads, args.concurrency, mix, args.requests,
+                           args.time_limit_ms, args.preload, args.seed, log=log)
+
+    report = {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "mix": args.mix,
+            "time_limit_ms": args.time_limit_ms,
+        },
+        "runs": runs,
+        "best": best_configs(runs),
+    }
+    for run in report["best"]:
+        print(f"BEST concurrency={run['concurrency']}: {run['worker_class']} workers={run['workers']} "
+              f"threads={run['threads']} solver_threads={run['solver_threads'] or 'default'} "
+              f"({run['throughput_rps']} req/s, p95 {run['p95_ms']} ms)")
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
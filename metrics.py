@@ -0,0 +1,100 @@
+import threading
+import time
+
+# Latency buckets in seconds, from fast-path solves to full time limits
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 60, 300)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for values, total in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labels, values)} {total}")
+        return lines
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {} # label values -> [bucket counts..., count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._values.setdefault(label_values, [0] * (len(self.buckets) + 1) + [0.0])
+            for k, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[k] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for values, series in sorted(self._values.items()):
+                for bound, count in zip(self.buckets + ("+Inf",), series[:-2] + [series[-2]]):
+                    labels = _labels(self.labels + ("le",), values + (bound,))
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                lines.append(f"{self.name}_count{_labels(self.labels, values)} {series[-2]}")
+                lines.append(f"{self.name}_sum{_labels(self.labels, values)} {round(series[-1], 6)}")
+        return lines
+
+class Registry:
+    """
+    Minimal Prometheus text-format registry. Metrics live in the web process:
+    solves that run in child processes (jobs, batches) are recorded when
+    their result comes back.
+    """
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, help, labels=()):
+        metric = Counter(name, help, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self, extra=()):
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+        lines += list(extra)
+        return "\n".join(lines) + "\n"
+
+class PhaseTimer:
+    """
+    Wall and CPU time of consecutive solve phases, in ms. CPU time is process
+    time, so it includes solver worker threads (CP-SAT, SCIP parallel).
+    """
+
+    def __init__(self):
+        self.stats = {}
+        self._wall, self._cpu = time.perf_counter(), time.process_time()
+
+    def lap(self, phase):
+        wall, cpu = time.perf_counter(), time.process_time()
+        self.stats[f"{phase}_ms"] = round(1000 * (wall - self._wall), 1)
+        self.stats[f"{phase}_cpu_ms"] = round(1000 * (cpu - self._cpu), 1)
+        self._wall, self._cpu = wall, cpu
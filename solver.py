@@ -0,0 +1,1509 @@
+"""
+Team assignment engines. Imported lazily by app.py on the first solve (or
+warmed up / preloaded by gunicorn.conf.py), so the web process starts and
+answers health checks without loading OR-Tools.
+"""
+import functools
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from metrics import PhaseTimer
+from ortools.graph.python import min_cost_flow
+from ortools.linear_solver import linear_solver_pb2, pywraplp
+from ortools.linear_solver.python import model_builder_helper
+from scipy import sparse
+
+# Default time budget for a solve, kept under Heroku's 30 second router timeout
+# (app.py reads the same variable to key time-limited results in its cache)
+DEFAULT_TIME_LIMIT_MS = int(os.environ.get("SOLVE_TIME_LIMIT_MS", 25000))
+
+# Weapon order of every index w (same as app.WEAPONS)
+WEAPONS = ["foil", "epee", "sabre"]
+
+# Objective weights shared by every formulation: they must agree, or the
+# formulations return different optima and the decomposition bound is wrong
+P_3M = 1000 # Penalty for 3M team (try to avoid)
+P_3F = 500  # Penalty for 3F team ("unless strictly necessary")
+B_Res_2F = 200 # Bonus for assigning reserve to 2F team
+
+STATUS_NAMES = {
+    pywraplp.Solver.OPTIMAL: "OPTIMAL",
+    pywraplp.Solver.FEASIBLE: "FEASIBLE",
+    pywraplp.Solver.INFEASIBLE: "INFEASIBLE",
+    pywraplp.Solver.UNBOUNDED: "UNBOUNDED",
+    pywraplp.Solver.ABNORMAL: "ABNORMAL",
+    pywraplp.Solver.MODEL_INVALID: "MODEL_INVALID",
+    pywraplp.Solver.NOT_SOLVED: "NOT_SOLVED",
+}
+
+def configure_solver(solver, options):
+    """
+    Applies time limit and thread count to a pywraplp solver and returns the
+    MPSolverParameters (relative MIP gap) to pass to Solve().
+    """
+    solver.SetTimeLimit(options.get("time_limit_ms", DEFAULT_TIME_LIMIT_MS))
+    if "threads" in options:
+        solver.SetNumThreads(options["threads"])
+    params = pywraplp.MPSolverParameters()
+    if "relative_gap" in options:
+        params.SetDoubleParam(params.RELATIVE_MIP_GAP, options["relative_gap"])
+    return params
+
+def previous_assignment(fencers, previous):
+    """
+    Maps a previous "teams" result onto the current entry list by name.
+    Returns {i: (t, w, r)} with t the position of the team in the result,
+    w the weapon index and r the role (0=Main, 1=Reserve).
+    """
+    index = {f["name"]: i for i, f in enumerate(fencers)}
+    assignment = {}
+    for t, team in enumerate(previous):
+        for w_name, member in team["members"].items():
+            if member.get("name") in index and w_name in WEAPONS:
+                assignment[index[member["name"]]] = (t, WEAPONS.index(w_name), 0)
+        for reserve in team.get("reserves", []):
+            if reserve.get("name") in index and reserve.get("weapon") in WEAPONS:
+                assignment[index[reserve["name"]]] = (t, WEAPONS.index(reserve["weapon"]), 1)
+    return assignment
+
+def teams_objective(teams):
+    """Recomputes the solve_holistic objective of a "teams" result."""
+    total = 0
+    for team in teams:
+        f_count = len([m for m in team["members"].values() if m["category"].upper() == "F"])
+        sign = -1 if f_count == 0 else 1
+        total += sum(sign * m["preference"] for m in team["members"].values())
+        total += sum(r["preference"].get(r["weapon"], 1) for r in team["reserves"])
+        if f_count == 0:
+            total -= P_3M
+        elif f_count == 3:
+            total -= P_3F
+        elif f_count == 2 and team["reserves"]:
+            total += B_Res_2F
+    return total
+
+def score_table(fencers):
+    """
+    Interns an entry list into the arrays shared by model building and result
+    extraction: scores[i, w] is fencer i's preference for weapon w (default
+    1; integer dtype when every preference is an integer, so results keep
+    the caller's numbers), female[i] and male[i] are category masks.
+    """
+    scores = np.array([[f["preference"].get(w, 1) for w in WEAPONS] for f in fencers]).reshape(len(fencers), 3)
+    if scores.dtype.kind not in "iuf":
+        scores = scores.astype(float)
+    female = np.array([f["category"].upper() == "F" for f in fencers], dtype=bool)
+    male = np.array([f["category"].upper() == "M" for f in fencers], dtype=bool)
+    return scores, female, male
+
+def teams_from_placements(fencers, scores, n_teams, placements):
+    """
+    Builds the "teams" result from one (i, t, w, r) row per fencer (r: 0=Main,
+    1=Reserve), so extraction is linear in the entry list. Members come out
+    in weapon order and preferences are read from the score table.
+    """
+    teams = [{"team": t + 1, "members": {}, "reserves": []} for t in range(n_teams)]
+    placements = placements[np.lexsort((placements[:, 2], placements[:, 1]))]
+    for i, t, w, r in placements.tolist():
+        if r == 0: # Main
+            teams[t]["members"][WEAPONS[w]] = {
+                "name": fencers[i]["name"],
+                "category": fencers[i]["category"],
+                "preference": scores[i, w].item() # Return scalar score
+            }
+        else: # Reserve, with the assigned weapon
+            teams[t]["reserves"].append(dict(fencers[i], weapon=WEAPONS[w]))
+    return teams
+
+def incumbent_event(start, objective, bound):
+    """
+    Progress payload passed to on_incumbent callbacks: time since `start`
+    (a time.monotonic() value), objective, bound and gap of a new incumbent.
+    """
+    return {
+        "elapsed_ms": round(1000 * (time.monotonic() - start), 1),
+        "objective": objective, "bound": bound, "gap": abs(bound - objective) / max(abs(objective), 1),
+    }
+
+# Relative gap below which a solve counts as proven optimal
+OPTIMALITY_GAP = 1e-6
+
+def checked_status(summary):
+    """
+    The engines report OPTIMAL when a relative_gap limit stops the search;
+    such a result is only FEASIBLE unless its gap is actually closed.
+    """
+    if summary["status"] == "OPTIMAL" and summary.get("gap", 0) > OPTIMALITY_GAP:
+        summary["status"] = "FEASIBLE"
+    return summary
+
+def solve_summary(solver, status):
+    """Status, incumbent objective, best bound and relative gap of a finished solve."""
+    summary = {"status": STATUS_NAMES.get(status, "UNKNOWN")}
+    if status in [pywraplp.Solver.OPTIMAL, pywraplp.Solver.FEASIBLE]:
+        objective = solver.Objective().Value()
+        bound = solver.Objective().BestBound()
+        summary["objective"] = objective
+        summary["bound"] = bound
+        summary["gap"] = abs(bound - objective) / max(abs(objective), 1)
+    return checked_status(summary)
+
+def linear_solver_nonzeros(solver):
+    """Number of constraint coefficients of a pywraplp model."""
+    proto = linear_solver_pb2.MPModelProto()
+    solver.ExportModelToProto(proto)
+    return sum(len(c.var_index) for c in proto.constraint)
+
+def cp_model_nonzeros(model):
+    """Number of variable references in the constraints of a CP-SAT model."""
+    total = 0
+    for ct in model.Proto().constraints:
+        body = getattr(ct, ct.WhichOneof("constraint"))
+        for field in ("vars", "literals"):
+            if field in body.DESCRIPTOR.fields_by_name:
+                total += len(getattr(body, field))
+        total += len(ct.enforcement_literal)
+    return total
+
+class SparseRows:
+    """
+    Accumulates linear constraints as blocks of rows with the same number of
+    terms, so a whole constraint family is added with one NumPy operation.
+    """
+
+    def __init__(self):
+        self.rows, self.cols, self.coefs, self.lower, self.upper = [], [], [], [], []
+        self.n_rows = 0
+
+    def add(self, cols, coefs, lb=-np.inf, ub=np.inf):
+        # cols: (rows, terms) variable indices; coefs/lb/ub broadcast to them
+        cols = np.asarray(cols)
+        n, k = cols.shape
+        self.rows.append(np.repeat(np.arange(self.n_rows, self.n_rows + n), k))
+        self.cols.append(cols.ravel())
+        self.coefs.append(np.broadcast_to(coefs, cols.shape).astype(float).ravel())
+        self.lower.append(np.broadcast_to(lb, (n,)).astype(float))
+        self.upper.append(np.broadcast_to(ub, (n,)).astype(float))
+        self.n_rows += n
+
+    def matrix(self, n_vars):
+        """Returns the CSR constraint matrix and the row bounds."""
+        matrix = sparse.csr_matrix(
+            (np.concatenate(self.coefs), (np.concatenate(self.rows), np.concatenate(self.cols))),
+            shape=(self.n_rows, n_vars),
+        )
+        matrix.eliminate_zeros() # Masked-out terms (e.g. males in a female count)
+        return matrix, np.concatenate(self.lower), np.concatenate(self.upper)
+
+def configure_model_solver(solver, options):
+    """Applies time limit, relative MIP gap and thread count to a SCIP ModelSolverHelper."""
+    solver.set_time_limit_in_seconds(options.get("time_limit_ms", DEFAULT_TIME_LIMIT_MS) / 1000)
+    params = []
+    if "relative_gap" in options:
+        params.append(f"limits/gap = {options['relative_gap']}")
+    if "threads" in options:
+        params.append(f"parallel/maxnthreads = {options['threads']}")
+    if params:
+        solver.set_solver_specific_parameters("\n".join(params))
+
+def model_summary(solver):
+    """Status, incumbent objective, best bound and relative gap of a finished ModelSolverHelper."""
+    status = solver.status().name if solver.has_response() else "NOT_SOLVED"
+    summary = {"status": status}
+    if status in ["OPTIMAL", "FEASIBLE"]:
+        objective = solver.objective_value()
+        bound = solver.best_objective_bound()
+        summary["objective"] = objective
+        summary["bound"] = bound
+        summary["gap"] = abs(bound - objective) / max(abs(objective), 1)
+    return checked_status(summary)
+
+def solve_holistic(fencers, options=None, on_incumbent=None, should_stop=None):
+    """
+    Solves the team assignment problem using a single holistic MILP model.
+    Encodes constraints for:
+    - Team Size (3 Main)
+    - Roles (Main vs Reserve)
+    - Gender constraints (avoid 3M/3F, prefer 2F/1M or 1F/2M)
+    - Reserve Rules (Match 2F, Mismatch 1F, No 3M)
+    - Objective: Maximize preference (Minimize for All-M)
+    Preferences and gender masks are precomputed as NumPy arrays and every
+    constraint family is added to the model as one sparse block.
+    on_incumbent and should_stop are only honoured by the cp-sat backend:
+    SCIP reports nothing until it returns.
+    With a `seed`, a small seeded perturbation of the objective picks one of
+    the tied optima at random; `solutions` > 1 adds up to that many
+    alternatives within `solution_tolerance` of the best, each a different
+    set of teams (team-mates, weapons or roles) from every line-up before it.
+    """
+    options = options or {}
+    if options.get("backend") == "cp-sat":
+        return solve_holistic_cpsat(fencers, options, on_incumbent, should_stop)
+    timer = PhaseTimer()
+
+    # --- Data Prep ---
+    n_fencers = len(fencers)
+    n_teams = n_fencers // 3
+    if n_teams == 0:
+        return {"teams": [], "reserves": fencers} # Not enough for 1 team
+
+    n_weapons = 3
+    N, T, W = n_fencers, n_teams, n_weapons
+
+    # scores[i, w]: preference of fencer i for weapon w
+    scores, female, male = score_table(fencers)
+    female, male = female.astype(float), male.astype(float)
+
+    # --- Variables ---
+    # x[i, t, w, r]: 1 if fencer i is in team t with weapon w and role r (0=Main, 1=Reserve)
+    # ind[t, g]: gender composition of the MAIN slots of team t, g = 3M, 1F, 2F, 3F
+    # z[i, t, w]: x[i, t, w, Main] AND is_3m[t] (reserves are banned from 3M teams)
+    # res_2f[t]: team t is 2F and has a reserve
+    x = np.arange(N * T * W * 2).reshape(N, T, W, 2)
+    ind = x.size + np.arange(T * 4).reshape(T, 4)
+    z = ind.size + x.size + np.arange(N * T * W).reshape(N, T, W)
+    res_2f = z.size + ind.size + x.size + np.arange(T)
+    n_vars = res_2f[-1] + 1
+    is_3m, is_1f, is_2f, is_3f = ind[:, 0], ind[:, 1], ind[:, 2], ind[:, 3]
+
+    rows = SparseRows()
+
+    # --- Hard Constraints ---
+
+    # 1. Every fencer assigned exactly once (Main OR Reserve)
+    rows.add(x.reshape(N, -1), 1, 1, 1)
+
+    # 2. Team Composition: each team has exactly 1 Main Person per Weapon
+    rows.add(x[:, :, :, 0].transpose(1, 2, 0).reshape(T * W, N), 1, 1, 1)
+
+    # 3. Reserve Constraint + 5a. NO Reserve on 3M Team
+    # Sum(Reserve in T) <= 1 - is_3m[t]
+    reserves_t = x[:, :, :, 1].transpose(1, 0, 2).reshape(T, N * W)
+    rows.add(np.hstack([reserves_t, is_3m[:, None]]), 1, ub=1)
+
+    # 4. Gender Classification Constraints (Indicators)
+    # Strictly one is true, and n_f_main == 1*is_1f + 2*is_2f + 3*is_3f
+    rows.add(ind, 1, 1, 1)
+    main_t = x[:, :, :, 0].transpose(1, 0, 2).reshape(T, N * W)
+    rows.add(
+        np.hstack([main_t, ind[:, 1:]]),
+        np.hstack([np.repeat(female, W), [-1, -2, -3]]),
+        0, 0,
+    )
+
+    # 5b. Reserve Matching Rules for Male Reserves
+    # 1F: m_res_w + main_is_female[w] <= 2 - is_1f[t]
+    # 2F: m_res_w <= main_is_female[w] + (1 - is_2f[t])
+    main_tw = x[:, :, :, 0].transpose(1, 2, 0).reshape(T * W, N)
+    res_tw = x[:, :, :, 1].transpose(1, 2, 0).reshape(T * W, N)
+    rows.add(np.hstack([res_tw, main_tw, np.repeat(is_1f, W)[:, None]]), np.hstack([male, female, [1]]), ub=2)
+    rows.add(np.hstack([res_tw, main_tw, np.repeat(is_2f, W)[:, None]]), np.hstack([male, -female, [1]]), ub=1)
+
+    # 6. res_2f[t] = is_2f[t] AND has reserve
+    rows.add(np.stack([res_2f, is_2f], axis=1), [1, -1], ub=0)
+    rows.add(np.hstack([res_2f[:, None], reserves_t]), np.hstack([[1], -np.ones(N * W)]), ub=0)
+    rows.add(np.hstack([res_2f[:, None], is_2f[:, None], reserves_t]), np.hstack([[1, -1], -np.ones(N * W)]), lb=-1)
+
+    # 7. z = x AND is_3m (Main slots only)
+    x_main = x[:, :, :, 0].ravel()
+    z_3m = np.broadcast_to(is_3m[None, :, None], (N, T, W)).ravel()
+    rows.add(np.stack([z.ravel(), x_main], axis=1), [1, -1], ub=0)
+    rows.add(np.stack([z.ravel(), z_3m], axis=1), [1, -1], ub=0)
+    rows.add(np.stack([z.ravel(), x_main, z_3m], axis=1), [1, -1, -1], lb=-1)
+
+    # --- Objective Function ---
+    # Maximize sum of scores; 3M teams count their scores negatively:
+    # Term = score * x - 2 * score * z
+    objective = np.zeros(n_vars)
+    objective[x] = np.broadcast_to(scores[:, None, :, None], x.shape)
+    objective[z] = -2 * np.broadcast_to(scores[:, None, :], z.shape)
+    objective[is_3m] = -P_3M
+    objective[is_3f] = -P_3F
+    objective[res_2f] = B_Res_2F
+
+    # --- Warm Start ---
+    # Seed the solver with the previous result for fencers still entered
+    previous = previous_assignment(fencers, options.get("previous", []))
+    previous = {i: (t, w, r) for i, (t, w, r) in previous.items() if t < n_teams}
+    hinted = np.array([x[i, t, w, r] for i, (t, w, r) in previous.items()], dtype=int)
+
+    # Stability: reward keeping fencers where the previous result put them
+    objective[hinted] += options.get("stability_weight", 0)
+
+    # --- Tie-Breaking ---
+    # Each fencer takes exactly one placement, so a perturbation below 0.5 / N
+    # per placement adds less than half a point: with integer preferences it
+    # only decides between tied line-ups, at random but reproducibly.
+    base_objective = objective
+    integral = np.all(objective == np.round(objective))
+    if options.get("seed") is not None:
+        objective = objective.copy()
+        objective[x] += np.random.default_rng(options["seed"]).random(x.shape) * 0.5 / N
+
+    # --- Model ---
+    matrix, lower, upper = rows.matrix(n_vars)
+    model = model_builder_helper.ModelBuilderHelper()
+    model.fill_model_from_sparse_data(np.zeros(n_vars), np.ones(n_vars), objective, lower, upper, matrix)
+    for var in range(n_vars):
+        model.set_var_integrality(var, True)
+    model.set_maximize(True)
+    for var in hinted:
+        model.add_hint(int(var), 1.0)
+    solver = model_builder_helper.ModelSolverHelper("scip")
+    configure_model_solver(solver, options)
+    timer.lap("build")
+
+    # --- Solve ---
+    deadline = time.monotonic() + options.get("time_limit_ms", DEFAULT_TIME_LIMIT_MS) / 1000
+    solver.solve(model)
+    timer.lap("solve")
+    summary = model_summary(solver)
+    summary["stats"] = timer.stats
+    timer.stats.update(variables=int(n_vars), constraints=int(matrix.shape[0]), nonzeros=int(matrix.nnz))
+
+    if summary["status"] not in ["OPTIMAL", "FEASIBLE"]:
+        return {"error": "No solution found", **summary}
+
+    # --- Extract Results ---
+    def extract(summary):
+        # Each fencer has exactly one placement: take it per row of the solution
+        values = solver.variable_values()
+        t, w, r = np.unravel_index(values[x].reshape(N, -1).argmax(axis=1), (T, W, 2))
+        placements = np.stack([np.arange(N), t, w, r], axis=1)
+        if objective is not base_objective:
+            # Report the unperturbed objective; with integer weights the
+            # optimum is an integer, so the perturbed bound rounds down
+            value = float(base_objective @ np.round(values[:n_vars])) # Cuts add variables after x
+            bound = float(np.floor(summary["bound"] + 1e-6)) if integral else summary["bound"]
+            summary.update(status=solver.status().name, objective=value, bound=bound,
+                           gap=abs(bound - value) / max(abs(value), 1))
+            checked_status(summary) # Judged on the unperturbed gap
+        return placements, teams_from_placements(fencers, scores, n_teams, placements)
+
+    placements, result_list = extract(summary)
+    timer.lap("extract")
+    result = {"teams": result_list, **summary}
+
+    # --- Alternatives ---
+    # Teams are interchangeable, so a no-good cut on x itself would only
+    # relabel them: each cut forbids the previous line-up as a set of teams.
+    # kept[k] must be 1 when any team t holds every placement of found team
+    # k, and at least one found team must not be kept, so alternatives may
+    # differ in who fences together as well as in weapons and roles.
+    n_solutions = options.get("solutions", 1)
+    if n_solutions > 1:
+        result["alternatives"] = []
+        floor = model.add_linear_constraint()
+        for var in np.flatnonzero(base_objective):
+            model.add_term_to_constraint(floor, int(var), float(base_objective[var]))
+        model.set_constraint_lower_bound(floor, summary["objective"] - options.get("solution_tolerance", 0) - 1e-6)
+        model.clear_hints()
+        while len(result["alternatives"]) < n_solutions - 1 and time.monotonic() < deadline:
+            cut = model.add_linear_constraint()
+            for k in range(T):
+                team = placements[placements[:, 1] == k]
+                kept = model.add_var()
+                model.set_var_lower_bound(kept, 0)
+                model.set_var_upper_bound(kept, 1)
+                model.set_var_integrality(kept, True)
+                model.add_term_to_constraint(cut, kept, 1.0)
+                # sum(placements of team k in team t) - kept[k] <= size - 1
+                for t in range(T):
+                    row = model.add_linear_constraint()
+                    model.add_term_to_constraint(row, kept, -1.0)
+                    for var in x[team[:, 0], t, team[:, 2], team[:, 3]]:
+                        model.add_term_to_constraint(row, int(var), 1.0)
+                    model.set_constraint_upper_bound(row, len(team) - 1)
+            model.set_constraint_upper_bound(cut, T - 1)
+            solver.set_time_limit_in_seconds(max(0.01, deadline - time.monotonic()))
+            solver.solve(model)
+            alternative = model_summary(solver)
+            if alternative["status"] not in ["OPTIMAL", "FEASIBLE"]:
+                break # No other line-up within the tolerance
+            placements, teams = extract(alternative)
+            result["alternatives"].append({"teams": teams, "status": alternative["status"], "objective": alternative["objective"]})
+        timer.lap("alternatives")
+    return result
+
+def solve_holistic_cpsat(fencers, options=None, on_incumbent=None, should_stop=None):
+    """
+    CP-SAT version of solve_holistic: same variables and rules, but gender
+    and reserve logic use native enforced constraints instead of big-M
+    rows and the z linearization, and the search runs a parallel portfolio
+    of `threads` workers (all cores by default). on_incumbent(event) is
+    called with an incumbent_event for each improving solution; the search
+    stops early, keeping its incumbent, once should_stop() returns true.
+    The model proto is written directly from NumPy index arrays (creating
+    one Python object per variable dominated large builds), and the time
+    limit covers the build as well as the search.
+    """
+    from ortools.sat import cp_model_pb2
+    from ortools.sat.python import cp_model # Pulls in pandas: only load it for this backend
+
+    timer = PhaseTimer()
+    start = time.monotonic()
+    options = options or {}
+    deadline = start + options.get("time_limit_ms", DEFAULT_TIME_LIMIT_MS) / 1000
+
+    # --- Data Prep ---
+    n_fencers = len(fencers)
+    n_teams = n_fencers // 3
+    if n_teams == 0:
+        return {"teams": [], "reserves": fencers} # Not enough for 1 team
+
+    n_weapons = 3
+    N, T, W = n_fencers, n_teams, n_weapons
+    scores, female, male = score_table(fencers)
+    n_reserves = N - 3 * T
+
+    # CP-SAT needs integer coefficients
+    stability_weight = options.get("stability_weight", 0)
+    scale = 1 if np.all(scores == np.round(scores)) and stability_weight == int(stability_weight) else 100
+    int_scores = np.round(scores * scale).astype(int)
+
+    # --- Variables ---
+    # x[i, t, w, r]: 1 if fencer i is in team t with weapon w and role r (0=Main, 1=Reserve)
+    # ind[t, g]: gender composition of the MAIN slots of team t, g = 3M, 1F, 2F, 3F
+    # team_score[t]: main score of team t, negated for 3M teams
+    # res_2f[t]: team t is 2F and has a reserve
+    # x comes first, in (i, t, w, r) order: results are read from the
+    # leading slice of the solution vector
+    x = np.arange(N * T * W * 2).reshape(N, T, W, 2)
+    ind = x.size + np.arange(T * 4).reshape(T, 4)
+    team_score = x.size + ind.size + np.arange(T)
+    res_2f = team_score[-1] + 1 + np.arange(T)
+    is_3m, is_1f, is_2f, is_3f = ind[:, 0], ind[:, 1], ind[:, 2], ind[:, 3]
+
+    model = cp_model.CpModel()
+    proto = model.Proto()
+    boolean = cp_model_pb2.IntegerVariableProto(domain=[0, 1])
+    proto.variables.extend([boolean] * (x.size + ind.size))
+    proto.variables.extend([cp_model_pb2.IntegerVariableProto(domain=[-15 * scale, 15 * scale])] * T)
+    proto.variables.extend([boolean] * T)
+
+    def negated(literal):
+        return -int(literal) - 1
+
+    def exactly_one(literals):
+        proto.constraints.add().exactly_one.literals.extend(np.ravel(literals).tolist())
+
+    def at_most_one(literals):
+        proto.constraints.add().at_most_one.literals.extend(np.ravel(literals).tolist())
+
+    def linear(variables, coefs, lb, ub, enforce=None):
+        constraint = proto.constraints.add()
+        if enforce is not None:
+            constraint.enforcement_literal.append(int(enforce))
+        variables = np.asarray(variables)
+        constraint.linear.vars.extend(variables.ravel().tolist())
+        constraint.linear.coeffs.extend(np.broadcast_to(coefs, variables.shape).astype(int).ravel().tolist())
+        constraint.linear.domain.extend([int(lb), int(ub)])
+
+    # --- Hard Constraints ---
+
+    # 1. Every fencer assigned exactly once (Main OR Reserve)
+    for i in range(N):
+        exactly_one(x[i])
+
+    # 2. Each team has exactly 1 Main Person per Weapon
+    for t in range(T):
+        for w in range(W):
+            exactly_one(x[:, t, w, 0])
+
+    # Redundant aggregate constraints: they tighten the LP relaxation and let
+    # CP-SAT prove female-scarce inputs infeasible without enumerating teams
+    linear(x[:, :, :, 1], 1, n_reserves, n_reserves)
+    linear(is_3m, 1, 0, T - n_reserves)
+    linear(ind[:, 1:], [1, 2, 3], 0, int(female.sum()))
+
+    # Per-team index lists: each team row only touches its own variables
+    female_idx, male_idx = np.flatnonzero(female), np.flatnonzero(male)
+    objective_vars, objective_coefs = [], []
+    for t in range(T):
+        reserves = x[:, t, :, 1]
+
+        # 3. At most 1 Reserve, none on a 3M team
+        at_most_one(reserves)
+        linear(reserves, 1, 0, 0, enforce=is_3m[t])
+
+        # 4. Gender Classification
+        exactly_one(ind[t])
+        linear(np.concatenate([x[female_idx, t, :, 0].ravel(), ind[t, 1:]]),
+               np.concatenate([np.ones(len(female_idx) * W), [-1, -2, -3]]), 0, 0)
+
+        # 5. Reserve Matching Rules for Male Reserves
+        for w in range(W):
+            m_res_w, f_main_w = x[male_idx, t, w, 1], x[female_idx, t, w, 0]
+            # 1F: male reserve must NOT take the F weapon
+            linear(np.concatenate([m_res_w, f_main_w]), 1, 0, 1, enforce=is_1f[t])
+            # 2F: male reserve must take one of the F weapons
+            linear(np.concatenate([m_res_w, f_main_w]), np.concatenate([np.ones(len(m_res_w)), -np.ones(len(f_main_w))]),
+                   -len(f_main_w), 0, enforce=is_2f[t])
+
+        # --- Objective Terms ---
+        # 3M teams count their main scores negatively
+        main = x[:, t, :, 0].ravel()
+        linear(np.concatenate([[team_score[t]], main]), np.concatenate([[1], -int_scores.ravel()]), 0, 0,
+               enforce=negated(is_3m[t]))
+        linear(np.concatenate([[team_score[t]], main]), np.concatenate([[1], int_scores.ravel()]), 0, 0,
+               enforce=is_3m[t])
+
+        # Bonus for a 2F team with a reserve
+        implication = proto.constraints.add()
+        implication.enforcement_literal.append(int(res_2f[t]))
+        implication.bool_or.literals.append(int(is_2f[t]))
+        linear(reserves, 1, 1, N, enforce=res_2f[t])
+
+        objective_vars += [reserves.ravel(), [team_score[t], res_2f[t], is_3m[t], is_3f[t]]]
+        objective_coefs += [int_scores.ravel(), [1, B_Res_2F * scale, -P_3M * scale, -P_3F * scale]]
+
+    # --- Warm Start ---
+    previous = previous_assignment(fencers, options.get("previous", []))
+    previous = {i: (t, w, r) for i, (t, w, r) in previous.items() if t < n_teams}
+    hinted = [int(x[i, t, w, r]) for i, (t, w, r) in previous.items()]
+    proto.solution_hint.vars.extend(hinted)
+    proto.solution_hint.values.extend([1] * len(hinted))
+    if stability_weight and hinted:
+        objective_vars.append(hinted)
+        objective_coefs.append([int(round(stability_weight * scale))] * len(hinted))
+
+    # CP-SAT minimizes: a maximization is stored negated with scaling -1
+    proto.objective.vars.extend(np.concatenate(objective_vars).astype(int).tolist())
+    proto.objective.coeffs.extend((-np.concatenate(objective_coefs)).astype(int).tolist())
+    proto.objective.scaling_factor = -1
+
+    solver = cp_model.CpSolver()
+    solver.parameters.num_workers = options.get("threads", 0) # 0 = all cores
+    if "relative_gap" in options:
+        solver.parameters.relative_gap_limit = options["relative_gap"]
+    # The search log is only read for the number of workers CP-SAT starts
+    workers = []
+    solver.parameters.log_search_progress = True
+    solver.parameters.log_to_stdout = False
+    solver.log_callback = lambda line: workers.append(line.strip()) if " workers" in line else None
+    timer.lap("build")
+    solver.parameters.max_time_in_seconds = max(0.01, deadline - time.monotonic())
+
+    # --- Solve ---
+    class Progress(cp_model.CpSolverSolutionCallback):
+        def on_solution_callback(self):
+            on_incumbent(incumbent_event(start, self.ObjectiveValue() / scale, self.BestObjectiveBound() / scale))
+
+    done = threading.Event()
+    if should_stop is not None:
+        def watch():
+            while not done.wait(0.1):
+                if should_stop():
+                    solver.StopSearch()
+                    return
+        threading.Thread(target=watch, name="cpsat-stop", daemon=True).start()
+    try:
+        status = solver.Solve(model, Progress() if on_incumbent is not None else None)
+    finally:
+        done.set()
+    timer.lap("solve")
+
+    started = [line for line in workers if line.startswith("Setting number of workers to ")]
+    summary = {"status": "NOT_SOLVED" if status == cp_model.UNKNOWN else solver.StatusName(status)}
+    summary["stats"] = timer.stats
+    timer.stats.update(
+        variables=len(proto.variables),
+        constraints=len(proto.constraints),
+        nonzeros=cp_model_nonzeros(model),
+        nodes=solver.NumBranches(),
+        workers=int(started[0].split()[-1]) if started else solver.parameters.num_workers,
+    )
+    if status not in [cp_model.OPTIMAL, cp_model.FEASIBLE]:
+        return {"error": "No solution found", **summary}
+
+    objective = solver.ObjectiveValue() / scale
+    bound = solver.BestObjectiveBound() / scale
+    summary.update({"objective": objective, "bound": bound, "gap": abs(bound - objective) / max(abs(objective), 1)})
+    checked_status(summary)
+
+    # --- Extract Results ---
+    # Bulk read of the solution vector, one placement per fencer
+    values = np.array(solver.ResponseProto().solution[:x.size]).reshape(N, -1)
+    t, w, r = np.unravel_index(values.argmax(axis=1), (T, W, 2))
+    placements = np.stack([np.arange(N), t, w, r], axis=1)
+    teams_out = teams_from_placements(fencers, scores, n_teams, placements)
+
+    timer.lap("extract")
+    return {"teams": teams_out, **summary}
+
+def team_compositions():
+    """
+    Lists every valid team composition as (female_main_weapons, reserve).
+    reserve is None, ("M", w) for a male reserve fencing weapon w, or
+    ("free", w) for any other reserve (no matching rule applies to them).
+    Compositions already encode the reserve rules of solve_holistic:
+    no reserve on 3M, male reserve mismatches on 1F and matches on 2F.
+    """
+    compositions = []
+    for mask in range(8):
+        female_w = tuple(w for w in range(3) if mask >> w & 1)
+        compositions.append((female_w, None))
+        if not female_w:
+            continue # No reserve on 3M
+        for w in range(3):
+            if len(female_w) == 1:
+                male_ok = w not in female_w
+            elif len(female_w) == 2:
+                male_ok = w in female_w
+            else:
+                male_ok = True
+            if male_ok:
+                compositions.append((female_w, ("M", w)))
+            compositions.append((female_w, ("free", w)))
+    return compositions
+
+def solve_aggregated(fencers, options=None):
+    """
+    Solves the same problem as solve_holistic with an aggregated MILP.
+    Teams are not labelled: integer variables count how many teams of each
+    composition (female main weapons + reserve slot) are formed and each
+    fencer only picks a weapon and a role. There is no team symmetry and no
+    linearization variables, so the model grows linearly with the entries.
+    The aggregate solution is expanded deterministically into labelled teams.
+    """
+    timer = PhaseTimer()
+    solver = pywraplp.Solver.CreateSolver("SCIP")
+    if not solver:
+        return {"error": "Solver not found"}
+
+    # --- Data Prep ---
+    n_fencers = len(fencers)
+    n_teams = n_fencers // 3
+    if n_teams == 0:
+        return {"teams": [], "reserves": fencers} # Not enough for 1 team
+
+    n_weapons = 3
+    scores, is_female, is_male = score_table(fencers)
+    compositions = team_compositions()
+
+    # --- Variables ---
+    # n[k]: number of teams formed with composition k
+    n = {k: solver.IntVar(0, n_teams, f"n_{k}") for k in range(len(compositions))}
+
+    # a[i, w, c]: 1 if fencer i fences weapon w with role class c
+    # c: 0=Main (team with 1+ F), 1=Main (3M team), 2=Reserve
+    MAIN, MAIN_3M, RESERVE = 0, 1, 2
+    a = {}
+    for i in range(n_fencers):
+        for w in range(n_weapons):
+            a[i, w, MAIN] = solver.BoolVar(f"a_{i}_{w}_main")
+            if not is_female[i]:
+                a[i, w, MAIN_3M] = solver.BoolVar(f"a_{i}_{w}_main3m")
+            a[i, w, RESERVE] = solver.BoolVar(f"a_{i}_{w}_res")
+
+    # --- Hard Constraints ---
+
+    # 1. Every fencer assigned exactly once
+    for i in range(n_fencers):
+        solver.Add(
+            solver.Sum(a[i, w, c] for w in range(n_weapons) for c in (MAIN, MAIN_3M, RESERVE) if (i, w, c) in a) == 1
+        )
+
+    # 2. Exactly n_teams teams
+    solver.Add(solver.Sum(n.values()) == n_teams)
+
+    # 3. Slot counts: the fencers picking a (weapon, role) fill exactly the
+    # slots of that kind opened by the chosen compositions
+    for w in range(n_weapons):
+        female_main = solver.Sum(a[i, w, MAIN] for i in range(n_fencers) if is_female[i])
+        other_main = solver.Sum(a[i, w, MAIN] for i in range(n_fencers) if not is_female[i])
+        main_3m = solver.Sum(a[i, w, MAIN_3M] for i in range(n_fencers) if not is_female[i])
+        male_res = solver.Sum(a[i, w, RESERVE] for i in range(n_fencers) if is_male[i])
+        free_res = solver.Sum(a[i, w, RESERVE] for i in range(n_fencers) if not is_male[i])
+
+        solver.Add(female_main == solver.Sum(
+            n[k] for k, (female_w, _) in enumerate(compositions) if w in female_w))
+        solver.Add(other_main == solver.Sum(
+            n[k] for k, (female_w, _) in enumerate(compositions) if female_w and w not in female_w))
+        solver.Add(main_3m == solver.Sum(
+            n[k] for k, (female_w, _) in enumerate(compositions) if not female_w))
+        solver.Add(male_res == solver.Sum(
+            n[k] for k, (_, res) in enumerate(compositions) if res == ("M", w)))
+        solver.Add(free_res == solver.Sum(
+            n[k] for k, (_, res) in enumerate(compositions) if res == ("free", w)))
+
+    # --- Objective Function ---
+    # Same weights as solve_holistic, applied per composition instead of per team
+
+    obj_expr = 0
+    for k, (female_w, res) in enumerate(compositions):
+        if not female_w:
+            obj_expr -= P_3M * n[k]
+        elif len(female_w) == 3:
+            obj_expr -= P_3F * n[k]
+        elif len(female_w) == 2 and res is not None:
+            obj_expr += B_Res_2F * n[k]
+
+    for (i, w, c), var in a.items():
+        score = scores[i, w].item()
+        obj_expr += (-score if c == MAIN_3M else score) * var
+
+    solver.Maximize(obj_expr)
+
+    # --- Solve ---
+    params = configure_solver(solver, options or {})
+    timer.lap("build")
+    status = solver.Solve(params)
+    timer.lap("solve")
+    summary = solve_summary(solver, status)
+    summary["stats"] = timer.stats
+    timer.stats.update(
+        variables=solver.NumVariables(),
+        constraints=solver.NumConstraints(),
+        nonzeros=linear_solver_nonzeros(solver),
+        nodes=solver.nodes(),
+    )
+
+    if status not in [pywraplp.Solver.OPTIMAL, pywraplp.Solver.FEASIBLE]:
+        return {"error": "No solution found", **summary}
+
+    # --- Expand Aggregate Solution ---
+    picks = []
+    for (i, w, c), var in a.items():
+        if var.solution_value() > 0.5:
+            if c == MAIN:
+                picks.append((i, ("F" if is_female[i] else "O", w)))
+            elif c == MAIN_3M:
+                picks.append((i, ("3M", w)))
+            else:
+                picks.append((i, ("M" if is_male[i] else "free", w, "res")))
+    counts = [round(n[k].solution_value()) for k in range(len(compositions))]
+    result_list, _ = expand_compositions(fencers, scores, compositions, counts, picks)
+
+    timer.lap("extract")
+    return {"teams": result_list, **summary}
+
+def expand_compositions(fencers, scores, compositions, counts, picks):
+    """
+    Expands aggregate composition counts into labelled teams.
+    picks lists (fencer index, slot) in input order, where slot is
+    ("F" | "O" | "3M", w) for a main and ("M" | "free", w, "res") for a
+    reserve; each slot kind is filled first come, first served.
+    Returns (teams, rosters) with rosters[t] the fencer indices of teams[t].
+    """
+    # Queue fencers by the kind of slot they picked, in input order
+    queues = {}
+    for i, key in picks:
+        queues.setdefault(key, []).append(i)
+    for queue in queues.values():
+        queue.reverse() # pop() from the end keeps input order
+
+    result_list, rosters = [], []
+    for (female_w, res), count in zip(compositions, counts):
+        for _ in range(count):
+            team = {"team": len(result_list) + 1, "members": {}, "reserves": []}
+            roster = []
+            for w in range(3):
+                if not female_w:
+                    i = queues[("3M", w)].pop()
+                else:
+                    i = queues[("F" if w in female_w else "O", w)].pop()
+                roster.append(int(i))
+                team["members"][WEAPONS[w]] = {
+                    "name": fencers[i]["name"],
+                    "category": fencers[i]["category"],
+                    "preference": scores[i, w].item()
+                }
+            if res is not None:
+                kind, w = res
+                i = queues[(kind, w, "res")].pop()
+                roster.append(int(i))
+                team["reserves"].append(dict(fencers[i], weapon=WEAPONS[w]))
+            result_list.append(team)
+            rosters.append(roster)
+    return result_list, rosters
+
+# --- Decomposition ---
+# Gender patterns of the main slots, indexed by their number of female mains
+PATTERNS = ["3M", "1F", "2F", "3F"]
+
+def solve_master(fencers, n_teams, options):
+    """
+    Master problem of solve_decomposed: splits the entry list into the gender
+    patterns and decides how many teams of each pattern (with or without a
+    reserve) to form. Weapons are relaxed: a main is valued at their best
+    score (worst on a 3M team, which counts negatively) and a reserve at
+    their best score, so the optimum is an upper bound on the full model.
+    Fencers with the same gender, best and worst score are interchangeable
+    here, so the model counts them per class and stays small for any entry
+    list size. Returns (summary, groups, n_pattern) with groups[g] the fencer
+    indices of pattern g, or (summary, None, None) if no split exists.
+    """
+    scores, female, _ = score_table(fencers)
+    classes, members, sizes = np.unique(
+        np.stack([female, scores.max(axis=1), scores.min(axis=1)], axis=1),
+        axis=0, return_inverse=True, return_counts=True,
+    )
+    class_female, class_best, class_worst = classes.T
+    C, G = len(classes), len(PATTERNS)
+
+    # --- Variables ---
+    # y[c, g, r]: fencers of class c in pattern g with role r (0=Main, 1=Reserve)
+    # n_teams_g[g, r]: number of pattern g teams without (r=0) or with (r=1) a reserve
+    y = np.arange(C * G * 2).reshape(C, G, 2)
+    n_teams_g = y.size + np.arange(G * 2).reshape(G, 2)
+    n_vars = y.size + n_teams_g.size
+
+    upper = np.zeros(n_vars)
+    upper[y] = sizes[:, None, None]
+    upper[n_teams_g] = n_teams
+    upper[y[class_female == 1, 0, 0]] = 0 # No woman on a 3M team
+    upper[y[:, 0, 1]] = 0 # No reserve on 3M
+    upper[n_teams_g[0, 1]] = 0
+
+    rows = SparseRows()
+    rows.add(y.reshape(C, -1), 1, sizes, sizes)
+    rows.add(n_teams_g.reshape(1, -1), 1, n_teams, n_teams)
+    n_female = np.arange(G)
+    # Female and other mains fill exactly the slots opened by each pattern
+    rows.add(np.hstack([y[:, :, 0].T, n_teams_g]),
+             np.hstack([np.broadcast_to(class_female, (G, C)), -np.repeat(n_female[:, None], 2, axis=1)]), 0, 0)
+    rows.add(np.hstack([y[:, :, 0].T, n_teams_g]),
+             np.hstack([np.broadcast_to(1 - class_female, (G, C)), -np.repeat(3 - n_female[:, None], 2, axis=1)]), 0, 0)
+    rows.add(np.hstack([y[:, :, 1].T, n_teams_g[:, 1:]]), np.hstack([np.ones((G, C)), -np.ones((G, 1))]), 0, 0)
+
+    objective = np.zeros(n_vars)
+    objective[y[:, 0, 0]] = -class_worst
+    objective[y[:, 1:, 0]] = class_best[:, None]
+    objective[y[:, :, 1]] = class_best[:, None]
+    objective[n_teams_g[0]] = -P_3M
+    objective[n_teams_g[3]] = -P_3F
+    objective[n_teams_g[2, 1]] = B_Res_2F
+
+    matrix, lower, row_upper = rows.matrix(n_vars)
+    model = model_builder_helper.ModelBuilderHelper()
+    model.fill_model_from_sparse_data(np.zeros(n_vars), upper, objective, lower, row_upper, matrix)
+    for var in range(n_vars):
+        model.set_var_integrality(var, True)
+    model.set_maximize(True)
+    solver = model_builder_helper.ModelSolverHelper("scip")
+    configure_model_solver(solver, options)
+    solver.solve(model)
+    summary = model_summary(solver)
+    summary["size"] = (int(n_vars), int(matrix.shape[0]), int(matrix.nnz))
+    if summary["status"] not in ["OPTIMAL", "FEASIBLE"]:
+        return summary, None, None
+
+    # Hand out the fencers of each class to the patterns, in input order
+    values = np.round(solver.variable_values()).astype(int)
+    groups = [[] for _ in range(G)]
+    for c in range(C):
+        queue = np.flatnonzero(members == c).tolist()
+        for g in range(G):
+            take = values[y[c, g]].sum()
+            groups[g] += queue[:take]
+            queue = queue[take:]
+    groups = [sorted(group) for group in groups]
+    n_pattern = [int(values[n_teams_g[g]].sum()) for g in range(G)]
+    return summary, groups, n_pattern
+
+def solve_compositions(fencers, n_teams, compositions, options):
+    """
+    Forms exactly n_teams teams out of the given fencers using only the given
+    team compositions (see team_compositions). This is the aggregated model,
+    built in bulk and solved with SCIP through ModelBuilder, which releases
+    the GIL so several of these sub-problems can solve in parallel threads.
+    Used for the pattern subproblems of solve_decomposed and the
+    neighbourhoods of solve_lns. Returns (summary, teams, rosters) where
+    rosters[t] lists the fencer indices of teams[t] (teams is None when no
+    solution was found).
+    """
+    N, W, K = len(fencers), 3, len(compositions)
+    MAIN, MAIN_3M, RESERVE = 0, 1, 2
+    scores, female, male = score_table(fencers)
+    female, male = female.astype(float), male.astype(float)
+
+    # a[i, w, c]: fencer i fences weapon w with role class c
+    # (Main on a team with 1+ F, Main on a 3M team, Reserve)
+    # n_comp[k]: number of teams formed with composition k
+    a = np.arange(N * W * 3).reshape(N, W, 3)
+    n_comp = a.size + np.arange(K)
+    n_vars = a.size + K
+    upper = np.ones(n_vars)
+    upper[n_comp] = n_teams
+    upper[a[female == 1, :, MAIN_3M]] = 0
+
+    def opens(slot):
+        # Slots of a kind that each composition opens on each weapon, shape (W, K)
+        return np.array([[slot(female_w, res, w) for female_w, res in compositions] for w in range(W)], dtype=float)
+
+    rows = SparseRows()
+    rows.add(a.reshape(N, -1), 1, 1, 1)
+    rows.add(n_comp[None, :], 1, n_teams, n_teams)
+    for c, mask, slot in [
+        (MAIN, female, lambda female_w, res, w: w in female_w),
+        (MAIN, 1 - female, lambda female_w, res, w: bool(female_w) and w not in female_w),
+        (MAIN_3M, 1 - female, lambda female_w, res, w: not female_w),
+        (RESERVE, male, lambda female_w, res, w: res == ("M", w)),
+        (RESERVE, 1 - male, lambda female_w, res, w: res == ("free", w)),
+    ]:
+        cols = np.hstack([a[:, :, c].T, np.broadcast_to(n_comp, (W, K))])
+        rows.add(cols, np.hstack([np.broadcast_to(mask, (W, N)), -opens(slot)]), 0, 0)
+
+    objective = np.zeros(n_vars)
+    objective[a[:, :, MAIN]] = scores
+    objective[a[:, :, MAIN_3M]] = -scores
+    objective[a[:, :, RESERVE]] = scores
+    for k, (female_w, res) in enumerate(compositions):
+        if not female_w:
+            objective[n_comp[k]] = -P_3M
+        elif len(female_w) == 3:
+            objective[n_comp[k]] = -P_3F
+        elif len(female_w) == 2 and res is not None:
+            objective[n_comp[k]] = B_Res_2F
+
+    matrix, lower, row_upper = rows.matrix(n_vars)
+    model = model_builder_helper.ModelBuilderHelper()
+    model.fill_model_from_sparse_data(np.zeros(n_vars), upper, objective, lower, row_upper, matrix)
+    for var in range(n_vars):
+        model.set_var_integrality(var, True)
+    model.set_maximize(True)
+    solver = model_builder_helper.ModelSolverHelper("scip")
+    configure_model_solver(solver, options)
+    solver.solve(model)
+    summary = model_summary(solver)
+    summary["size"] = (int(n_vars), int(matrix.shape[0]), int(matrix.nnz))
+    if summary["status"] not in ["OPTIMAL", "FEASIBLE"]:
+        return summary, None, None
+
+    values = solver.variable_values()
+    picks = []
+    for i, w, c in np.argwhere(values[a] > 0.5):
+        if c == MAIN:
+            picks.append((i, ("F" if female[i] else "O", w)))
+        elif c == MAIN_3M:
+            picks.append((i, ("3M", w)))
+        else:
+            picks.append((i, ("M" if male[i] else "free", w, "res")))
+    counts = [round(v) for v in values[n_comp]]
+    return (summary, *expand_compositions(fencers, scores, compositions, counts, picks))
+
+def solve_decomposed(fencers, options=None):
+    """
+    Decomposition for very large entry lists. A master problem splits the
+    fencers into gender patterns (3M, 1F, 2F, 3F, with or without reserve)
+    using best-weapon scores, then each pattern's weapon slots are assigned by
+    its own subproblem, all solved in parallel. The master optimum bounds the
+    full model, so the reported gap is against that bound.
+    """
+    options = options or {}
+    timer = PhaseTimer()
+    deadline = time.monotonic() + options.get("time_limit_ms", DEFAULT_TIME_LIMIT_MS) / 1000
+
+    n_teams = len(fencers) // 3
+    if n_teams == 0:
+        return {"teams": [], "reserves": fencers} # Not enough for 1 team
+
+    # --- Master ---
+    master, groups, n_pattern = solve_master(fencers, n_teams, options)
+    timer.lap("master")
+    stats = timer.stats
+    size = [master["size"]]
+    if groups is None:
+        stats.update(variables=size[0][0], constraints=size[0][1], nonzeros=size[0][2])
+        return {"error": "No solution found", "status": master["status"], "stats": stats}
+
+    # --- Subproblems ---
+    def solve_group(g):
+        sub_options = dict(options, time_limit_ms=max(100, int(1000 * (deadline - time.monotonic()))))
+        compositions = [c for c in team_compositions() if len(c[0]) == g]
+        return solve_compositions([fencers[i] for i in groups[g]], n_pattern[g], compositions, sub_options)
+
+    patterns = [g for g in range(len(PATTERNS)) if n_pattern[g]]
+    with ThreadPoolExecutor(max_workers=max(1, len(patterns))) as pool:
+        subproblems = dict(zip(patterns, pool.map(solve_group, patterns)))
+    timer.lap("solve")
+
+    teams, statuses = [], []
+    for g in patterns:
+        summary, sub_teams, _ = subproblems[g]
+        size.append(summary["size"])
+        statuses.append(summary["status"])
+        if sub_teams is None:
+            stats.update(variables=sum(s[0] for s in size), constraints=sum(s[1] for s in size))
+            return {"error": "No solution found", "status": summary["status"], "stats": stats}
+        teams += sub_teams
+    for number, team in enumerate(teams, start=1):
+        team["team"] = number
+
+    objective = teams_objective(teams)
+    bound = master["bound"]
+    gap = abs(bound - objective) / max(abs(objective), 1)
+    optimal = gap <= OPTIMALITY_GAP and master["status"] == "OPTIMAL" and all(s == "OPTIMAL" for s in statuses)
+    timer.lap("extract")
+    stats.update(
+        variables=sum(s[0] for s in size),
+        constraints=sum(s[1] for s in size),
+        nonzeros=sum(s[2] for s in size),
+    )
+    return {
+        "teams": teams, "status": "OPTIMAL" if optimal else "FEASIBLE",
+        "objective": objective, "bound": bound, "gap": gap,
+        "decomposition": {PATTERNS[g]: {"teams": n_pattern[g], "fencers": len(groups[g]), "status": statuses[k]}
+                          for k, g in enumerate(patterns)},
+        "stats": stats,
+    }
+
+# --- Large Neighbourhood Search ---
+LNS_MAX_TEAMS = 8 # Largest neighbourhood re-optimised at once
+
+def greedy_teams(fencers, scores, groups, n_pattern):
+    """
+    Greedy line-up on a gender split from solve_master: within each pattern,
+    mains take their best weapon that still has a free slot (their worst on
+    3M teams), most opinionated fencers first, and each reserve joins the
+    team where the reserve rules let them fence their best weapon.
+    Returns (teams, rosters) like expand_compositions.
+    """
+    _, female, male = score_table(fencers)
+    score, is_female, is_male = scores.tolist(), female.tolist(), male.tolist()
+    placements, rosters = [], []
+    for n_female, (group, n) in enumerate(zip(groups, n_pattern)):
+        if not n:
+            continue
+        by_score = sorted(group, key=lambda i: -max(score[i]))
+        mains = [i for i in by_score if is_female[i]][:n_female * n] + \
+                [i for i in by_score if not is_female[i]][:(3 - n_female) * n]
+        taken = set(mains)
+        reserves = [i for i in by_score if i not in taken]
+
+        # Weapon slots: n per weapon; 3M teams score negatively
+        sign = -1 if n_female == 0 else 1
+        slots = {(kind, w): [] for kind in (True, False) for w in range(3)}
+        free = [n] * 3
+        def regret(i):
+            ranked = sorted(sign * x for x in score[i])
+            return ranked[-1] - ranked[-2]
+
+        for i in sorted(mains, key=regret, reverse=True):
+            w = max((w for w in range(3) if free[w]), key=lambda w: sign * score[i][w])
+            free[w] -= 1
+            slots[is_female[i], w].append(i)
+
+        # Teams: the minority gender of the pattern fixes each team's layout
+        group_teams = []
+        if n_female in (0, 3):
+            for j in range(n):
+                group_teams.append([slots[n_female == 3, w][j] for w in range(3)])
+        else:
+            anchor = n_female == 1 # 1F: one woman per team, 2F: one man per team
+            for w in range(3):
+                for i in slots[anchor, w]:
+                    group_teams.append([i if v == w else slots[not anchor, v].pop() for v in range(3)])
+
+        # Reserves: best allowed weapon on a team without a reserve
+        placed = {}
+        for i in reserves:
+            best = None
+            for t, roster in enumerate(group_teams):
+                if t in placed:
+                    continue
+                female_w = [w for w in range(3) if is_female[roster[w]]]
+                for w in range(3):
+                    if is_male[i]:
+                        if len(female_w) == 1 and w in female_w:
+                            continue
+                        if len(female_w) == 2 and w not in female_w:
+                            continue
+                    if best is None or score[i][w] > score[i][best[1]]:
+                        best = (t, w)
+            placed[best[0]] = (i, best[1])
+
+        for t, roster in enumerate(group_teams):
+            placements += [(i, len(rosters), w, 0) for w, i in enumerate(roster)]
+            if t in placed:
+                placements.append((placed[t][0], len(rosters), placed[t][1], 1))
+                roster = roster + [placed[t][0]]
+            rosters.append(roster)
+    return teams_from_placements(fencers, scores, len(rosters), np.array(placements)), rosters
+
+def solve_lns(fencers, options=None, on_incumbent=None, should_stop=None):
+    """
+    Large-neighbourhood search, for when a near-optimal line-up within the
+    time limit is worth more than a proof of optimality. Starts from
+    greedy_teams on the master's gender split, then repeatedly frees a few
+    random teams (often including the weakest) and re-optimises them with
+    solve_compositions, keeping every improvement. The neighbourhood grows
+    when the search stalls; the search ends at the time limit or when the
+    largest neighbourhood stops improving, or as soon as should_stop()
+    returns true. on_incumbent(event) is called with an incumbent_event for
+    each new incumbent. The master optimum is the bound.
+    """
+    options = options or {}
+    timer = PhaseTimer()
+    start = time.monotonic()
+    deadline = start + options.get("time_limit_ms", DEFAULT_TIME_LIMIT_MS) / 1000
+
+    n_teams = len(fencers) // 3
+    if n_teams == 0:
+        return {"teams": [], "reserves": fencers} # Not enough for 1 team
+
+    # --- Start ---
+    master, groups, n_pattern = solve_master(fencers, n_teams, options)
+    if groups is None:
+        timer.lap("build")
+        return {"error": "No solution found", "status": master["status"], "stats": timer.stats}
+    teams, rosters = greedy_teams(fencers, score_table(fencers)[0], groups, n_pattern)
+    values = [teams_objective([team]) for team in teams]
+    incumbents = []
+
+    def improved():
+        event = incumbent_event(start, sum(values), master["bound"])
+        incumbents.append({"elapsed_ms": event["elapsed_ms"], "objective": event["objective"]})
+        if on_incumbent is not None:
+            on_incumbent(event)
+
+    improved()
+    timer.lap("build")
+
+    # --- Search ---
+    rnd = random.Random(0)
+    compositions = team_compositions()
+    size = min(3, n_teams)
+    stall = iterations = 0
+    proven = False
+    while time.monotonic() < deadline and not (should_stop is not None and should_stop()):
+        iterations += 1
+        chosen = rnd.sample(range(n_teams), size)
+        weakest = min(range(n_teams), key=values.__getitem__)
+        if weakest not in chosen and rnd.random() < 0.5:
+            chosen[0] = weakest
+        freed = [i for t in chosen for i in rosters[t]]
+        sub_options = dict(options, time_limit_ms=max(10, min(1000, int(1000 * (deadline - time.monotonic())))))
+        summary, sub_teams, sub_rosters = solve_compositions(
+            [fencers[i] for i in freed], size, compositions, sub_options)
+
+        gain = summary.get("objective", -np.inf) - sum(values[t] for t in chosen)
+        if sub_teams is not None and gain > 1e-6:
+            for t, team, roster in zip(chosen, sub_teams, sub_rosters):
+                teams[t], rosters[t] = team, [freed[i] for i in roster]
+                values[t] = teams_objective([team])
+            improved()
+            stall = 0
+        else:
+            stall += 1
+        if size == n_teams and summary["status"] == "OPTIMAL":
+            proven = True # The neighbourhood was the whole problem
+            break
+        if sum(values) >= master["bound"] - 1e-6:
+            break # Reached the master bound
+        if stall >= max(10, 2 * n_teams // size):
+            if size >= min(LNS_MAX_TEAMS, n_teams):
+                break
+            size, stall = size + 1, 0
+    timer.lap("solve")
+
+    for number, team in enumerate(teams, start=1):
+        team["team"] = number
+    objective = sum(values)
+    bound = objective if proven else master["bound"]
+    gap = abs(bound - objective) / max(abs(objective), 1)
+    status = "OPTIMAL" if gap <= OPTIMALITY_GAP else "FEASIBLE"
+    timer.lap("extract")
+    return {
+        "teams": teams, "status": status, "objective": objective, "bound": bound, "gap": gap,
+        "lns": {"iterations": iterations, "neighbourhood_teams": size, "incumbents": incumbents},
+        "stats": timer.stats,
+    }
+
+def female_reserve_window(fencers):
+    """
+    Returns the (min, max) number of female reserves that lets every team be
+    1F or 2F with every reserve on a 2F team, or None when no such split exists.
+    """
+    n_teams = len(fencers) // 3
+    n_reserves = len(fencers) - 3 * n_teams
+    n_female = sum(1 for f in fencers if f["category"].upper() == "F")
+    # Female mains must lie in [n_teams + n_reserves, 2 * n_teams]
+    low = max(0, n_female - 2 * n_teams, n_reserves - (len(fencers) - n_female))
+    high = min(n_reserves, n_female - n_teams - n_reserves)
+    if n_teams == 0 or low > high:
+        return None
+    return low, high
+
+def classify_problem(fencers):
+    """
+    Pre-solve classifier. Returns "assignment" when the gender counts leave
+    room for a penalty-free split (every team 1F/2F, every reserve on a 2F
+    team) and all preferences are non-negative integers, "holistic" otherwise.
+    """
+    if female_reserve_window(fencers) is None:
+        return "holistic"
+    for f in fencers:
+        for score in f["preference"].values():
+            if isinstance(score, bool) or not isinstance(score, (int, float)):
+                return "holistic"
+            if score < 0 or score != int(score):
+                return "holistic"
+    return "assignment"
+
+def _slot_assignment(scores, is_female, n_teams, female_cap, other_cap):
+    """
+    Min-cost flow: every fencer gets a main weapon (n_teams per weapon) or a
+    reserve slot, capped per gender group. Returns (score, choices) where
+    choices[i] is a weapon index or "reserve", or None if infeasible.
+    """
+    n_fencers = len(scores)
+    n_reserves = n_fencers - 3 * n_teams
+    source, sink = n_fencers, n_fencers + 7
+    main_node = [n_fencers + 1 + w for w in range(3)]
+    res_female, res_other, res_all = n_fencers + 4, n_fencers + 5, n_fencers + 6
+
+    smcf = min_cost_flow.SimpleMinCostFlow()
+    arcs = []
+    for i in range(n_fencers):
+        smcf.add_arc_with_capacity_and_unit_cost(source, i, 1, 0)
+        for w in range(3):
+            arcs.append((smcf.add_arc_with_capacity_and_unit_cost(i, main_node[w], 1, -scores[i][w]), i, w))
+        res_node = res_female if is_female[i] else res_other
+        arcs.append((smcf.add_arc_with_capacity_and_unit_cost(i, res_node, 1, -max(scores[i])), i, "reserve"))
+    for w in range(3):
+        smcf.add_arc_with_capacity_and_unit_cost(main_node[w], sink, n_teams, 0)
+    smcf.add_arc_with_capacity_and_unit_cost(res_female, res_all, female_cap, 0)
+    smcf.add_arc_with_capacity_and_unit_cost(res_other, res_all, other_cap, 0)
+    smcf.add_arc_with_capacity_and_unit_cost(res_all, sink, n_reserves, 0)
+    smcf.set_node_supply(source, n_fencers)
+    smcf.set_node_supply(sink, -n_fencers)
+
+    if smcf.solve() != smcf.OPTIMAL:
+        return None
+    choices = [None] * n_fencers
+    for arc, i, choice in arcs:
+        if smcf.flow(arc) > 0:
+            choices[i] = choice
+    return -smcf.optimal_cost(), choices
+
+def solve_assignment(fencers, options=None):
+    """
+    Polynomial-time fast path for problems routed here by classify_problem.
+    Solves the weapon-slot assignment as a min-cost flow, then arranges the
+    slots into 1F/2F teams with every reserve on a 2F team, matching the
+    reserve rules. The flow without gender caps plus the best bonuses is an
+    upper bound on the MILP objective, so the result is only returned when
+    it provably reaches the MILP optimum; returns None otherwise.
+    """
+    timer = PhaseTimer()
+    window = female_reserve_window(fencers)
+    if window is None:
+        return None
+
+    # --- Data Prep ---
+    n_fencers = len(fencers)
+    n_teams = n_fencers // 3
+    n_reserves = n_fencers - 3 * n_teams
+    is_female = [f["category"].upper() == "F" for f in fencers]
+    scores = [[int(f["preference"].get(w, 1)) for w in WEAPONS] for f in fencers]
+
+
+    timer.lap("build")
+
+    # --- Slot Assignment ---
+    low, high = window
+    capped = _slot_assignment(scores, is_female, n_teams, high, n_reserves - low)
+    relaxed = _slot_assignment(scores, is_female, n_teams, n_reserves, n_reserves)
+    if capped is None or relaxed is None:
+        return None
+    # Any MILP solution outside the gender window loses a reserve bonus or
+    # pays a 3M/3F penalty, so the capped flow is optimal if it is close enough
+    allowance = B_Res_2F if n_reserves else min(P_3M, P_3F)
+    if capped[0] < relaxed[0] - allowance:
+        return None
+    choices = capped[1]
+    timer.lap("solve")
+
+    # --- Team Arrangement ---
+    female_main = [[i for i in range(n_fencers) if is_female[i] and choices[i] == w] for w in range(3)]
+    other_main = [[i for i in range(n_fencers) if not is_female[i] and choices[i] == w] for w in range(3)]
+    reserves = [i for i in range(n_fencers) if choices[i] == "reserve"]
+    f_count = [len(q) for q in female_main]
+    n_pairs = sum(f_count) - n_teams
+    pair_types = [(0, 1), (0, 2), (1, 2)]
+
+    # Each reserve needs its own 2F team; male reserves must match a F weapon
+    reserve_options = []
+    for i in reserves:
+        best = [w for w in range(3) if scores[i][w] == max(scores[i])]
+        if fencers[i]["category"].upper() == "M":
+            reserve_options.append([(p, w) for p in range(3) for w in best if w in pair_types[p]])
+        else:
+            reserve_options.append([(p, best[0]) for p in range(3)])
+
+    def place_reserves(pairs, placed):
+        k = len(placed)
+        if k == len(reserves):
+            return placed
+        for p, w in reserve_options[k]:
+            if sum(1 for q, _ in placed if q == p) < pairs[p]:
+                found = place_reserves(pairs, placed + [(p, w)])
+                if found is not None:
+                    return found
+        return None
+
+    arrangement = None
+    for p01 in range(n_pairs + 1):
+        for p02 in range(n_pairs - p01 + 1):
+            pairs = (p01, p02, n_pairs - p01 - p02)
+            if any(sum(pairs[p] for p in range(3) if w in pair_types[p]) > f_count[w] for w in range(3)):
+                continue
+            placed = place_reserves(pairs, [])
+            if placed is not None:
+                arrangement = (pairs, placed)
+                break
+        if arrangement is not None:
+            break
+    if arrangement is None:
+        return None
+    pairs, placed = arrangement
+
+    # --- Build Teams ---
+    team_female_w = []
+    for p in range(3):
+        team_female_w += [pair_types[p]] * pairs[p]
+    for w in range(3):
+        team_female_w += [(w,)] * (f_count[w] - sum(pairs[p] for p in range(3) if w in pair_types[p]))
+
+    for queue in female_main + other_main:
+        queue.reverse() # pop() from the end keeps input order
+
+    result_list = []
+    for female_w in team_female_w:
+        team = {"team": len(result_list) + 1, "members": {}, "reserves": []}
+        for w in range(3):
+            i = (female_main if w in female_w else other_main)[w].pop()
+            team["members"][WEAPONS[w]] = {
+                "name": fencers[i]["name"],
+                "category": fencers[i]["category"],
+                "preference": fencers[i]["preference"].get(WEAPONS[w], 1)
+            }
+        result_list.append(team)
+
+    for i, (p, w) in zip(reserves, placed):
+        team = next(t for t, female_w in zip(result_list, team_female_w)
+                    if female_w == pair_types[p] and not t["reserves"])
+        r_data = fencers[i].copy()
+        r_data["weapon"] = WEAPONS[w]
+        team["reserves"].append(r_data)
+
+    objective = capped[0] + B_Res_2F * n_reserves
+    timer.lap("extract")
+    return {"teams": result_list, "status": "OPTIMAL", "objective": objective, "bound": objective, "gap": 0.0, "stats": timer.stats}
+
+def solve_auto(fencers, options=None):
+    """
+    Default entry point: uses the assignment fast path when the classifier
+    allows it and falls back to solve_holistic when the gender and reserve
+    indicator logic actually binds, or for seeded draws and alternatives.
+    """
+    options = options or {}
+    stable = options.get("stability_weight") and options.get("previous")
+    draw = options.get("seed") is not None or options.get("solutions", 1) > 1
+    if not stable and not draw and classify_problem(fencers) == "assignment":
+        result = solve_assignment(fencers, options)
+        if result is not None:
+            return result
+    return solve_holistic(fencers, options)
+
+FORMULATIONS = {
+    "auto": solve_auto,
+    "holistic": solve_holistic,
+    "aggregated": solve_aggregated,
+    "decomposed": solve_decomposed,
+    "lns": solve_lns,
+}
+
+def solve_incremental(solve, fencers, options):
+    """
+    Re-solves only the part of a previous result affected by late changes.
+    Teams whose fencers are all still entered with the same category and
+    preferences (as recorded in the result) keep their number and line-up.
+    Teams of withdrawn or edited fencers, new entries and the
+    `neighbourhood_teams` weakest unchanged teams are re-optimised with
+    `solve`; the neighbourhood grows until that sub-problem is feasible.
+    """
+    previous = options["previous"]
+    by_name = {f["name"]: f for f in fencers}
+    n_teams = len(fencers) // 3
+    n_reserves = len(fencers) - 3 * n_teams
+
+    def unchanged(entry, w_name):
+        f = by_name.get(entry.get("name"))
+        if f is None or f["category"] != entry.get("category"):
+            return False
+        if isinstance(entry.get("preference"), dict):
+            return f["preference"] == entry["preference"]
+        return f["preference"].get(w_name, 1) == entry.get("preference")
+
+    stable = [
+        team for team in previous
+        if all(unchanged(m, w) for w, m in team["members"].items())
+        and all(unchanged(r, r.get("weapon")) for r in team.get("reserves", []))
+    ]
+    stable.sort(key=lambda team: teams_objective([team])) # Weakest first
+
+    release = options.get("neighbourhood_teams", 1)
+    while True:
+        kept = stable[release:]
+        # Kept teams must leave room for the new team count and reserves
+        while kept and (
+            len(kept) > n_teams
+            or sum(len(t.get("reserves", [])) for t in kept) > n_reserves
+            or (len(kept) == n_teams and sum(len(t["members"]) + len(t.get("reserves", [])) for t in kept) < len(fencers))
+        ):
+            with_reserve = [t for t in kept if t.get("reserves")]
+            if sum(len(t.get("reserves", [])) for t in kept) > n_reserves:
+                kept.remove(with_reserve[0])
+            else:
+                kept.pop(0)
+
+        kept_names = {m["name"] for t in kept for m in list(t["members"].values()) + t.get("reserves", [])}
+        sub_fencers = [f for f in fencers if f["name"] not in kept_names]
+        sub_options = {k: v for k, v in options.items() if k != "incremental"}
+        sub_options["previous"] = [t for t in previous if not any(t is k for k in kept)]
+        result = solve(sub_fencers, sub_options)
+        if "teams" in result or not kept:
+            break
+        release = max(1, 2 * release)
+
+    if "teams" not in result:
+        return result
+
+    # --- Merge ---
+    # Kept teams keep their published number where it still exists
+    kept = [dict(t, reserves=t.get("reserves", [])) for t in kept]
+    # Previous teams may come without a number, or with one that no longer exists
+    used = {t.get("team") for t in kept} & set(range(1, n_teams + 1))
+    free = iter(sorted(set(range(1, n_teams + 1)) - used))
+    teams = []
+    for team in kept:
+        number = team.get("team")
+        teams.append(dict(team, team=number if number in used else next(free)))
+        used.discard(number)
+    for team in result["teams"]:
+        teams.append(dict(team, team=next(free)))
+    teams.sort(key=lambda t: t["team"])
+
+    merged = {"teams": teams, "status": result.get("status") if not kept else "FEASIBLE"}
+    merged["objective"] = teams_objective(teams)
+    merged["incremental"] = {"kept_teams": len(kept), "resolved_teams": len(result["teams"])}
+    if "stats" in result:
+        merged["stats"] = result["stats"]
+    return merged
+
+# Formulations that report incumbents while solving and can be stopped early
+PROGRESS_FORMULATIONS = ["holistic", "lns"]
+
+def solve_request(formulation, fencers, options, on_incumbent=None, should_stop=None):
+    solve = FORMULATIONS[formulation]
+    if formulation in PROGRESS_FORMULATIONS:
+        solve = functools.partial(solve, on_incumbent=on_incumbent, should_stop=should_stop)
+    if options.get("incremental") and options.get("previous"):
+        return solve_incremental(solve, fencers, options)
+    return solve(fencers, options)
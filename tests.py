@@ -1,8 +1,22 @@
 import unittest
 import unittest.mock
+import gzip
 import json
+import logging
+import os
+import tempfile
+import threading
 import random
-from app import app
+import subprocess
+import sys
+import time
+import benchmark
+import loadtest
+import solver
+from app import app, FORMULATIONS, WEAPONS, JobQueue, ResultCache, cache_key, parse_solve_request, store_result
+from solver import classify_problem, solve_assignment, solve_holistic
+
+logging.getLogger("solver").setLevel(logging.WARNING) # Keep the per-solve log lines out of test output
 
 class TestExilesSolver(unittest.TestCase):
     def setUp(self):
@@ -19,6 +33,44 @@ class TestExilesSolver(unittest.TestCase):
             "preference": prefs
         }
 
+    def objective(self, teams):
+        # Recomputes the solve_holistic objective from a "teams" result
+        total = 0
+        for team in teams:
+            f_count = len([m for m in team["members"].values() if m["category"] == "F"])
+            sign = -1 if f_count == 0 else 1
+            total += sum(sign * m["preference"] for m in team["members"].values())
+            total += sum(r["preference"][r["weapon"]] for r in team["reserves"])
+            if f_count == 0: total -= 1000
+            if f_count == 3: total -= 500
+            if f_count == 2 and team["reserves"]: total += 200
+        return total
+
+    def assert_valid_teams(self, fencers, teams):
+        # Checks every rule of the model on a "teams" result
+        assigned = []
+        for team in teams:
+            self.assertEqual(sorted(team["members"]), ["epee", "foil", "sabre"])
+            self.assertLessEqual(len(team["reserves"]), 1)
+            assigned += [m["name"] for m in team["members"].values()]
+            assigned += [r["name"] for r in team["reserves"]]
+            f_weaps = [w for w, m in team["members"].items() if m["category"] == "F"]
+            for r in team["reserves"]:
+                self.assertNotEqual(len(f_weaps), 0, "3M Team should NOT have reserves")
+                if r["category"] == "M" and len(f_weaps) == 1:
+                    self.assertNotEqual(r["weapon"], f_weaps[0])
+                if r["category"] == "M" and len(f_weaps) == 2:
+                    self.assertIn(r["weapon"], f_weaps)
+        self.assertEqual(sorted(assigned), sorted(f["name"] for f in fencers))
+
+    def random_fencers(self, n, female_ratio, seed):
+        rnd = random.Random(seed)
+        return [{
+            "name": f"P{i}",
+            "category": "F" if rnd.random() < female_ratio else "M",
+            "preference": {w: rnd.randint(1, 5) for w in ["foil", "epee", "sabre"]}
+        } for i in range(n)]
+
     def test_basic_team_formation(self):
         # 6 People: 3M, 3F. Should form 2 teams.
         fencers = [
@@ -283,5 +335,519 @@ class TestExilesSolver(unittest.TestCase):
             if f_count == 0: # 3M
                 self.assertNotIn("reserves", t, f"Team {t['team']} is 3M but got a reserve!")
 
+    def test_aggregated_formulation_matches_holistic(self):
+        """The aggregated formulation reaches the same optimum and respects every rule"""
+        for n, female_ratio, seed in [(7, 0.4, 1), (12, 0.5, 2), (13, 0.8, 3), (14, 0.3, 4)]:
+            fencers = self.random_fencers(n, female_ratio, seed)
+            holistic = json.loads(self.app.post('/solve', json={"fencers": fencers}).data)
+            aggregated = json.loads(self.app.post('/solve', json={"fencers": fencers, "formulation": "aggregated"}).data)
+            self.assertIn("teams", aggregated)
+            self.assert_valid_teams(fencers, aggregated["teams"])
+            self.assertEqual(self.objective(aggregated["teams"]), self.objective(holistic["teams"]))
+
+    def test_decomposed_formulation(self):
+        for seed, ratio in [(0, 0.4), (1, 0.15), (2, 0.6)]:
+            fencers = self.random_fencers(25, ratio, seed)
+            optimum = json.loads(self.app.post('/solve', json={"fencers": fencers, "formulation": "aggregated"}).data)
+            data = json.loads(self.app.post('/solve', json={"fencers": fencers, "formulation": "decomposed"}).data)
+            self.assert_valid_teams(fencers, data["teams"])
+            self.assertEqual([t["team"] for t in data["teams"]], list(range(1, 9)))
+            self.assertAlmostEqual(data["objective"], self.objective(data["teams"]))
+            self.assertLessEqual(data["objective"], optimum["objective"] + 1e-6)
+            self.assertGreaterEqual(data["bound"] + 1e-6, optimum["objective"])
+            self.assertEqual(sum(p["teams"] for p in data["decomposition"].values()), 8)
+
+    def test_lns_formulation(self):
+        for seed, ratio in [(3, 0.4), (4, 0.15)]:
+            fencers = self.random_fencers(25, ratio, seed)
+            optimum = json.loads(self.app.post('/solve', json={"fencers": fencers, "formulation": "aggregated"}).data)
+            data = json.loads(self.app.post('/solve', json={"fencers": fencers, "formulation": "lns", "time_limit_ms": 3000}).data)
+            self.assert_valid_teams(fencers, data["teams"])
+            self.assertAlmostEqual(data["objective"], self.objective(data["teams"]))
+            self.assertLessEqual(data["objective"], optimum["objective"] + 1e-6)
+            self.assertGreaterEqual(data["bound"] + 1e-6, optimum["objective"])
+            trajectory = [inc["objective"] for inc in data["lns"]["incumbents"]]
+            self.assertEqual(trajectory, sorted(trajectory))
+            self.assertEqual(trajectory[-1], data["objective"])
+
+        # Anytime: a tight deadline still returns the incumbent in time
+        fencers = self.random_fencers(300, 0.3, 5)
+        start = time.time()
+        data = json.loads(self.app.post('/solve', json={"fencers": fencers, "formulation": "lns", "time_limit_ms": 300}).data)
+        self.assertLess(time.time() - start, 5)
+        self.assertEqual(len(data["teams"]), 100)
+
+    def test_columnar_and_gzip_payloads(self):
+        fencers = self.random_fencers(150, 0.4, 17)
+        columnar = "application/vnd.exiles.columnar+json"
+        payload = {
+            "names": [f["name"] for f in fencers],
+            "categories": "".join(f["category"] for f in fencers),
+            "preferences": [[f["preference"][w] for w in ["foil", "epee", "sabre"]] for f in fencers],
+            "formulation": "aggregated",
+        }
+        response = self.app.post('/solve', data=gzip.compress(json.dumps(payload).encode()), headers={
+            "Content-Type": columnar, "Content-Encoding": "gzip", "Accept-Encoding": "gzip"})
+        self.assertEqual(response.mimetype, columnar)
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        data = json.loads(gzip.decompress(response.data))
+
+        # Same solve (and cache entry) as the JSON request, as per-fencer indices
+        expected = json.loads(self.app.post('/solve', json={"fencers": fencers, "formulation": "aggregated"}).data)
+        self.assertEqual(data["objective"], expected["objective"])
+        placements = {}
+        for team in expected["teams"]:
+            for w, m in team["members"].items():
+                placements[m["name"]] = (team["team"], data["weapons"].index(w), 0)
+            for r in team["reserves"]:
+                placements[r["name"]] = (team["team"], data["weapons"].index(r["weapon"]), 1)
+        columns = data["placements"]
+        self.assertEqual(list(zip(columns["team"], columns["weapon"], columns["role"])),
+                         [placements[f["name"]] for f in fencers])
+
+        # Plain JSON answers by default; ragged columns are rejected
+        response = self.app.post('/solve', data=json.dumps(payload), headers={"Content-Type": columnar, "Accept": "application/json"})
+        self.assertIn("teams", json.loads(response.data))
+        response = self.app.post('/solve', data=json.dumps(dict(payload, categories="MF")), content_type=columnar)
+        self.assertEqual(response.status_code, 400)
+
+        # A zero quality refuses gzip even though the coding is listed
+        for accept in ["gzip;q=0, identity", "identity", "*;q=0"]:
+            response = self.app.post('/solve', data=json.dumps(payload), headers={"Content-Type": columnar, "Accept-Encoding": accept})
+            self.assertNotIn("Content-Encoding", response.headers)
+            self.assertEqual(json.loads(response.data)["objective"], data["objective"])
+        response = self.app.post('/solve', data=json.dumps(payload), headers={"Content-Type": columnar, "Accept-Encoding": "identity, *;q=0.5"})
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+
+    def test_seeded_draws_and_alternatives(self):
+        fencers = benchmark.generate_entries(12, 0.5, "flat", seed=3) # Every line-up ties on preferences
+        optimum = solve_holistic(fencers)["objective"]
+
+        def lineup(teams):
+            return {frozenset([(m["name"], w) for w, m in team["members"].items()]
+                              + [(r["name"], r["weapon"], "reserve") for r in team["reserves"]]) for team in teams}
+
+        draw = solve_holistic(fencers, {"seed": 1, "solutions": 3})
+        again = solve_holistic(fencers, {"seed": 1, "solutions": 3}) # Reproducible
+        self.assertEqual([draw["teams"]] + [a["teams"] for a in draw["alternatives"]],
+                         [again["teams"]] + [a["teams"] for a in again["alternatives"]])
+        self.assertEqual((draw["objective"], draw["bound"]), (optimum, optimum))
+        self.assertEqual(len(draw["alternatives"]), 2)
+        seen = [lineup(draw["teams"])]
+        for alternative in draw["alternatives"]:
+            self.assert_valid_teams(fencers, alternative["teams"])
+            self.assertEqual(alternative["objective"], optimum)
+            self.assertNotIn(lineup(alternative["teams"]), seen)
+            seen.append(lineup(alternative["teams"]))
+
+        # Everyone has one clear weapon: the optima differ only in team-mates
+        singles = [self.create_fencer(f"{c}{w}", c, w) for c in "MF" for w in ["foil", "epee", "sabre"]]
+        mates = solve_holistic(singles, {"solutions": 3})
+        lineups = [lineup(mates["teams"])] + [lineup(a["teams"]) for a in mates["alternatives"]]
+        self.assertEqual(len({frozenset(l) for l in lineups}), 3)
+        for alternative in mates["alternatives"]:
+            self.assertEqual(alternative["objective"], mates["objective"])
+            self.assertEqual(sorted((m["name"], w) for team in alternative["teams"] for w, m in team["members"].items()),
+                             sorted((m["name"], w) for team in mates["teams"] for w, m in team["members"].items()))
+
+        # Draws go through the MILP even when the fast path would apply
+        data = json.loads(self.app.post('/solve', json={"fencers": fencers, "seed": 2}).data)
+        self.assertEqual(data["objective"], optimum)
+        self.assertIn("variables", data["stats"])
+        response = self.app.post('/solve', json={"fencers": fencers, "seed": 2, "formulation": "lns"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_solve_stream(self):
+        def events(response):
+            return [(block.split("\n")[0][7:], json.loads(block.split("\n")[1][6:]))
+                    for block in response.data.decode().strip().split("\n\n") if block.startswith("event:")]
+
+        fencers = self.random_fencers(60, 0.3, 16)
+        response = self.app.post('/solve/stream', json={"fencers": fencers, "formulation": "lns", "time_limit_ms": 2000})
+        self.assertEqual(response.mimetype, "text/event-stream")
+        stream = events(response)
+        self.assertEqual([name for name, _ in stream[:-1]], ["incumbent"] * (len(stream) - 1))
+        self.assertGreaterEqual(len(stream), 2)
+        trajectory = [data["objective"] for _, data in stream[:-1]]
+        self.assertEqual(trajectory, sorted(trajectory))
+        self.assertTrue(all(data["gap"] >= 0 and data["bound"] >= data["objective"] for _, data in stream[:-1]))
+        name, result = stream[-1]
+        self.assertEqual(name, "result")
+        self.assert_valid_teams(fencers, result["teams"])
+        self.assertEqual(result["objective"], trajectory[-1])
+
+        # A cached result is sent straight away; bad input is rejected before streaming
+        again = events(self.app.post('/solve/stream', json={"fencers": fencers, "formulation": "lns", "time_limit_ms": 2000}))
+        self.assertEqual([name for name, _ in again], ["result"])
+        self.assertEqual(self.app.post('/solve/stream', json={"fencers": fencers[:2]}).status_code, 400)
+
+    def test_healthz_and_lazy_solver(self):
+        data = json.loads(self.app.get('/healthz').data)
+        self.assertEqual(data["status"], "ok")
+        self.assertEqual(set(FORMULATIONS), set(solver.FORMULATIONS))
+        self.assertEqual(WEAPONS, solver.WEAPONS)
+        # Importing the web app alone must not load OR-Tools
+        code = "import sys, app; print('solver' in sys.modules, 'ortools' in sys.modules)"
+        out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+        self.assertEqual(out.stdout.split(), ["False", "False"])
+
+    def test_input_validation(self):
+        fencers = [self.create_fencer(f"P{i}", "MF"[i % 2]) for i in range(6)]
+        fencers[1]["category"] = "X"
+        fencers[2]["preference"]["epee"] = 7
+        del fencers[3]["preference"]["sabre"]
+        fencers[4]["name"] = "P0"
+        response = self.app.post('/solve', json={"fencers": fencers})
+        self.assertEqual(response.status_code, 400)
+        errors = {(e["index"], e["field"]) for e in json.loads(response.data)["errors"]}
+        self.assertEqual(errors, {(1, "category"), (2, "preference.epee"), (3, "preference.sabre"), (4, "name")})
+
+        # Normalised: lower-case categories and integral floats are accepted, extra keys dropped
+        fencers = [dict(self.create_fencer(f"P{i}", "mf"[i % 2]), team="A") for i in range(6)]
+        fencers[0]["preference"]["foil"] = 5.0
+        data = json.loads(self.app.post('/solve', json={"fencers": fencers}).data)
+        members = [m for team in data["teams"] for m in team["members"].values()]
+        self.assertTrue(all(m["category"] in "MF" and "team" not in m for m in members))
+
+        # Infeasible gender / reserve counts are rejected without solving
+        for fencers in ([self.create_fencer("P0", "F")],
+                        [self.create_fencer(f"P{i}", "F") for i in range(5)],
+                        [self.create_fencer(f"M{i}", "M") for i in range(7)]):
+            response = self.app.post('/solve', json={"fencers": fencers})
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(json.loads(response.data)["status"], "INFEASIBLE")
+
+    def test_unknown_formulation(self):
+        response = self.app.post('/solve', json={"fencers": [], "formulation": "magic"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_assignment_fast_path(self):
+        """Gender-slack entry lists are solved by min-cost flow with the MILP optimum"""
+        for n, seed in [(9, 1), (13, 2), (14, 3), (17, 4), (20, 5)]:
+            fencers = self.random_fencers(n, 0.5, seed)
+            if classify_problem(fencers) != "assignment":
+                continue
+            fast = solve_assignment(fencers)
+            if fast is None:
+                continue
+            self.assert_valid_teams(fencers, fast["teams"])
+            self.assertEqual(self.objective(fast["teams"]), self.objective(solve_holistic(fencers)["teams"]))
+
+    def test_classifier_routes_binding_cases_to_milp(self):
+        # 1 F for 2 teams forces a 3M team: the indicator logic binds
+        fencers = [self.create_fencer("F1", "F")] + [self.create_fencer(f"M{i}", "M") for i in range(6)]
+        self.assertEqual(classify_problem(fencers), "holistic")
+        # 3 F for 2 teams and no reserve: every team can be 1F/2F
+        fencers = [self.create_fencer(f"F{i}", "F") for i in range(3)] + [self.create_fencer(f"M{i}", "M") for i in range(3)]
+        self.assertEqual(classify_problem(fencers), "assignment")
+
+    def test_solver_limits_and_summary(self):
+        fencers = self.random_fencers(10, 0.3, 6)
+        payload = {"fencers": fencers, "formulation": "holistic", "time_limit_ms": 10000, "relative_gap": 0.0, "threads": 1}
+        data = json.loads(self.app.post('/solve', json=payload).data)
+        self.assertIn(data["status"], ["OPTIMAL", "FEASIBLE"])
+        self.assertAlmostEqual(data["objective"], self.objective(data["teams"]))
+        self.assertGreaterEqual(data["bound"] + 1e-6, data["objective"])
+        self.assertGreaterEqual(data["gap"], 0)
+        self.assertGreater(data["stats"]["variables"], 0)
+        self.assertGreaterEqual(data["stats"]["build_ms"], 0)
+        self.assertGreaterEqual(data["stats"]["solve_ms"], 0)
+        self.assertGreaterEqual(data["stats"]["extract_ms"], 0)
+        # Scores are read back from the score table with the caller's types
+        for team in data["teams"]:
+            for w, member in team["members"].items():
+                self.assertIs(type(member["preference"]), int)
+                self.assertEqual(member["preference"], next(f for f in fencers if f["name"] == member["name"])["preference"][w])
+
+        for key, value in [("time_limit_ms", "soon"), ("time_limit_ms", True), ("time_limit_ms", 1.5),
+                           ("threads", "2"), ("seed", False), ("solutions", 2.5)]:
+            response = self.app.post('/solve', json={"fencers": fencers, key: value})
+            self.assertEqual(response.status_code, 400, (key, value))
+        response = self.app.post('/solve', json={"fencers": fencers, "time_limit_ms": 10000.0})
+        self.assertEqual(response.status_code, 200)
+        response = self.app.post('/solve', json={"fencers": fencers, "relative_gap": 2})
+        self.assertEqual(response.status_code, 400)
+
+        # A search stopped by the gap limit is not reported as optimal
+        fencers = benchmark.generate_entries(18, 0.2, seed=1)
+        data = json.loads(self.app.post('/solve', json={"fencers": fencers, "relative_gap": 0.5}).data)
+        self.assertGreater(data["gap"], 0)
+        self.assertEqual(data["status"], "FEASIBLE")
+
+    def test_solve_instrumentation(self):
+        fencers = self.random_fencers(9, 0.4, 12)
+        payload = {"fencers": fencers, "formulation": "aggregated"}
+        with self.assertLogs("solver", "INFO") as logs:
+            response = self.app.post('/solve', json=payload)
+        data = json.loads(response.data)
+        for key in ["build_ms", "build_cpu_ms", "solve_ms", "solve_cpu_ms", "extract_ms", "nonzeros", "nodes"]:
+            self.assertIn(key, data["stats"])
+        self.assertIn("parse;dur=", response.headers["Server-Timing"])
+        line = json.loads(logs.output[0].split(":", 2)[2])
+        self.assertEqual((line["event"], line["formulation"], line["fencers"]), ("solve", "aggregated", 9))
+        self.assertEqual(line["status"], data["status"])
+
+        data = json.loads(self.app.post('/solve', json=dict(payload, stats=False)).data)
+        self.assertNotIn("stats", data)
+
+        metrics = self.app.get('/metrics').data.decode()
+        self.assertIn('solves_total{source="solve",formulation="aggregated",status="OPTIMAL"}', metrics)
+        self.assertIn('solve_phase_seconds_count{formulation="aggregated",phase="solve"}', metrics)
+        self.assertIn('http_request_duration_seconds_bucket{endpoint="/solve",method="POST",code="200",le="+Inf"}', metrics)
+
+    def wait_for_job(self, job_id, timeout=60):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            job = json.loads(self.app.get(f'/jobs/{job_id}').data)
+            if job["status"] not in ("queued", "running"):
+                return job
+            time.sleep(0.1)
+        self.fail("Job did not finish in time")
+
+    def test_job_lifecycle(self):
+        fencers = self.random_fencers(10, 0.5, 7)
+        response = self.app.post('/jobs', json={"fencers": fencers})
+        self.assertEqual(response.status_code, 202)
+        job = json.loads(response.data)
+        self.assertEqual(response.headers["Location"], f"/jobs/{job['id']}")
+
+        job = self.wait_for_job(job["id"])
+        self.assertEqual(job["status"], "done")
+        self.assert_valid_teams(fencers, job["result"]["teams"])
+        # The job and /solve share one cache entry, in both directions
+        response = self.app.post('/solve', json={"fencers": fencers})
+        self.assertEqual(response.headers["X-Cache"], "HIT")
+        self.assertEqual(json.loads(response.data), job["result"])
+        fencers = self.random_fencers(10, 0.5, 8)
+        direct = json.loads(self.app.post('/solve', json={"fencers": fencers}).data)
+        job = json.loads(self.app.post('/jobs', json={"fencers": fencers}).data)
+        self.assertEqual(job["status"], "done")
+        self.assertEqual(job["result"], direct)
+
+        self.assertEqual(self.app.get('/jobs/unknown').status_code, 404)
+        self.assertEqual(self.app.delete('/jobs/unknown').status_code, 404)
+        self.assertEqual(self.app.post('/jobs', json={"fencers": fencers, "threads": 0}).status_code, 400)
+
+    def test_job_cancel(self):
+        # A female-scarce list goes to the MILP and takes a while to prove optimal
+        fencers = self.random_fencers(45, 0.25, 7)
+        job = json.loads(self.app.post('/jobs', json={"fencers": fencers, "formulation": "holistic"}).data)
+        job = json.loads(self.app.delete(f'/jobs/{job["id"]}').data)
+        self.assertIn(job["status"], ("running", "cancelled"))
+        ran = job["status"] == "running"
+        job = self.wait_for_job(job["id"])
+        self.assertEqual(job["status"], "cancelled")
+        self.assertNotIn("result", job)
+        if ran: # Jobs cancelled while queued never solved anything
+            time.sleep(0.2) # on_done runs just after the status changes
+            metrics = self.app.get('/metrics').data.decode()
+            self.assertIn('solves_total{source="job",formulation="holistic",status="CANCELLED"}', metrics)
+
+    def test_job_timeout(self):
+        finished = []
+        queue = JobQueue(time.sleep, concurrency=1, timeout_s=0.3,
+                         on_done=lambda args, state, result, ms: finished.append((args, state, result)))
+        job = queue.submit(30)
+        deadline = time.time() + 10
+        while not finished and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(queue.get(job["id"])["status"], "timeout")
+        # The hook sees failed jobs too, not only successful ones
+        self.assertEqual(finished, [((30,), "timeout", {"error": "Job timed out"})])
+
+    def test_result_cache(self):
+        fencers = self.random_fencers(11, 0.5, 8)
+        before = json.loads(self.app.get('/cache').data)
+        first = self.app.post('/solve', json={"fencers": fencers})
+        self.assertEqual(first.headers["X-Cache"], "MISS")
+        # Same entry list in another order hits the cache
+        second = self.app.post('/solve', json={"fencers": fencers[::-1]})
+        self.assertEqual(second.headers["X-Cache"], "HIT")
+        self.assertEqual(json.loads(first.data), json.loads(second.data))
+        # Different solver options do not
+        third = self.app.post('/solve', json={"fencers": fencers, "formulation": "aggregated"})
+        self.assertEqual(third.headers["X-Cache"], "MISS")
+
+        stats = json.loads(self.app.get('/cache').data)
+        self.assertEqual(stats["hits"] - before["hits"], 1)
+        self.assertEqual(stats["misses"] - before["misses"], 2)
+
+        # A time-limited incumbent is only reused with the budget it ran with
+        fencers = self.random_fencers(12, 0.5, 9)
+        args = parse_solve_request({"fencers": fencers})
+        incumbent = {"teams": [], "status": "FEASIBLE", "objective": 1}
+        store_result(args, incumbent)
+        response = self.app.post('/solve', json={"fencers": fencers, "time_limit_ms": 25000})
+        self.assertEqual((response.headers["X-Cache"], json.loads(response.data)), ("HIT", incumbent))
+        response = self.app.post('/solve', json={"fencers": fencers, "time_limit_ms": 30000})
+        self.assertEqual(response.headers["X-Cache"], "MISS")
+        job = self.wait_for_job(json.loads(self.app.post('/jobs', json={"fencers": fencers}).data)["id"])
+        self.assertEqual(job["result"]["status"], "OPTIMAL")
+
+    def test_result_cache_disk_tier(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "cache.sqlite")
+            key = cache_key([self.create_fencer("A", "M")], "auto", {})
+            ResultCache(max_entries=1, path=path).put(key, {"teams": []})
+            # A fresh process-level cache finds the entry on disk
+            cache = ResultCache(max_entries=1, path=path)
+            self.assertEqual(cache.get(key), {"teams": []})
+            self.assertEqual(cache.stats()["disk_hits"], 1)
+            expired = ResultCache(max_entries=1, path=path, ttl_s=0)
+            time.sleep(0.01)
+            self.assertIsNone(expired.get(key))
+
+    def line_ups(self, teams):
+        return {tuple(sorted((w, m["name"]) for w, m in t["members"].items())) for t in teams}
+
+    def test_incremental_resolve(self):
+        fencers = self.random_fencers(16, 0.4, 9)
+        base = json.loads(self.app.post('/solve', json={"fencers": fencers, "formulation": "holistic"}).data)
+
+        # P3 withdraws, a new fencer enters and P5 edits their preferences
+        changed = [f for f in fencers if f["name"] != "P3"] + [self.create_fencer("New", "F", "sabre")]
+        changed = [dict(f, preference={"foil": 1, "epee": 5, "sabre": 2}) if f["name"] == "P5" else f for f in changed]
+        payload = {"fencers": changed, "formulation": "holistic", "previous": base, "incremental": True}
+        data = json.loads(self.app.post('/solve', json=payload).data)
+
+        self.assert_valid_teams(changed, data["teams"])
+        self.assertEqual(sorted(t["team"] for t in data["teams"]), list(range(1, len(changed) // 3 + 1)))
+        self.assertGreater(data["incremental"]["kept_teams"], 0)
+        self.assertEqual(self.objective(data["teams"]), data["objective"])
+        # Kept teams are published unchanged
+        self.assertGreaterEqual(len(self.line_ups(data["teams"]) & self.line_ups(base["teams"])), data["incremental"]["kept_teams"])
+
+    def test_warm_start_stability(self):
+        fencers = self.random_fencers(10, 0.5, 10)
+        base = json.loads(self.app.post('/solve', json={"fencers": fencers, "formulation": "holistic"}).data)
+        payload = {"fencers": fencers[::-1], "formulation": "holistic", "previous": base["teams"], "stability_weight": 100}
+        data = json.loads(self.app.post('/solve', json=payload).data)
+        self.assertEqual(self.line_ups(data["teams"]), self.line_ups(base["teams"]))
+
+        response = self.app.post('/solve', json={"fencers": fencers, "previous": "teams"})
+        self.assertEqual(response.status_code, 400)
+        for team in ({"members": {"foil": "Alice"}}, dict(base["teams"][0], reserves="abc"),
+                     dict(base["teams"][0], reserves=[{"name": "P1", "category": "M", "preference": {}, "weapon": "bow"}]),
+                     dict(base["teams"][0], team=0)):
+            for incremental in (False, True):
+                payload = {"fencers": fencers, "previous": [team], "incremental": incremental}
+                self.assertEqual(self.app.post('/solve', json=payload).status_code, 400)
+
+        # Teams without reserves are accepted, also in incremental mode
+        previous = [{k: v for k, v in t.items() if k != "reserves"} for t in base["teams"]]
+        payload = {"fencers": fencers, "formulation": "holistic", "previous": previous, "incremental": True}
+        self.assertIn("teams", json.loads(self.app.post('/solve', json=payload).data))
+
+        # So are teams without numbers: kept teams are numbered afresh
+        fencers = self.random_fencers(16, 0.4, 9)
+        base = json.loads(self.app.post('/solve', json={"fencers": fencers, "formulation": "holistic"}).data)
+        previous = [{k: v for k, v in t.items() if k != "team"} for t in base["teams"]]
+        changed = [f for f in fencers if f["name"] != "P3"]
+        payload = {"fencers": changed, "formulation": "holistic", "previous": previous, "incremental": True}
+        response = self.app.post('/solve', json=payload)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertGreater(data["incremental"]["kept_teams"], 0)
+        self.assertEqual(sorted(t["team"] for t in data["teams"]), list(range(1, len(changed) // 3 + 1)))
+
+        # Non-finite weights are rejected rather than handed to the solver
+        for key in ("stability_weight", "relative_gap", "solution_tolerance"):
+            for value in ("NaN", "Infinity"):
+                body = f'{{"fencers": {json.dumps(fencers)}, "{key}": {value}}}'
+                self.assertEqual(self.app.post('/solve', data=body, content_type="application/json").status_code, 400)
+
+    def test_cpsat_backend(self):
+        for n, female_ratio, seed in [(7, 0.3, 11), (10, 0.5, 12), (11, 0.2, 13)]:
+            fencers = self.random_fencers(n, female_ratio, seed)
+            payload = {"fencers": fencers, "formulation": "holistic", "time_limit_ms": 20000}
+            scip = json.loads(self.app.post('/solve', json=payload).data)
+            cpsat = json.loads(self.app.post('/solve', json=dict(payload, backend="cp-sat", threads=2)).data)
+            self.assertEqual(cpsat["status"], scip["status"])
+            if "teams" not in scip:
+                continue # No women for 2 reserves: rejected before either solver runs
+            self.assertEqual(cpsat["stats"]["workers"], 2)
+            self.assert_valid_teams(fencers, cpsat["teams"])
+            self.assertEqual(self.objective(cpsat["teams"]), self.objective(scip["teams"]))
+            self.assertEqual(cpsat["objective"], self.objective(cpsat["teams"]))
+
+        response = self.app.post('/solve', json={"fencers": [], "backend": "gurobi"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_batch_solve(self):
+        pools = [self.random_fencers(9, 0.5, 14), self.random_fencers(13, 0.4, 15)]
+        payload = {
+            "formulation": "aggregated",
+            "items": [
+                {"fencers": pools[0]},
+                {"name": "missing fencers"},
+                {"fencers": pools[1], "formulation": "holistic"},
+            ]
+        }
+        response = self.app.post('/solve/batch', json=payload)
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        lines = {line["index"]: line for line in map(json.loads, filter(None, response.data.decode().splitlines()))}
+        self.assertEqual(sorted(lines), [0, 1, 2])
+        self.assertIn("error", lines[1])
+        for k in (0, 2):
+            self.assert_valid_teams(pools[k // 2], lines[k]["result"]["teams"])
+
+        self.assertEqual(self.app.post('/solve/batch', json={"items": "all"}).status_code, 400)
+
+        # Jobs and batch items share the solver process slots; a waiting stream sends empty keep-alive lines
+        web = sys.modules["app"]
+        for _ in range(web.SOLVER_PROCESSES):
+            web.solver_slots.acquire()
+        release = threading.Timer(0.5, lambda: [web.solver_slots.release() for _ in range(web.SOLVER_PROCESSES)])
+        release.start()
+        try:
+            job = json.loads(self.app.post('/jobs', json={"fencers": self.random_fencers(11, 0.5, 18)}).data)
+            time.sleep(0.1)
+            self.assertEqual(json.loads(self.app.get(f'/jobs/{job["id"]}').data)["status"], "queued")
+            with unittest.mock.patch.object(web, "STREAM_KEEPALIVE_S", 0.05):
+                response = self.app.post('/solve/batch', json={"items": [{"fencers": self.random_fencers(9, 0.5, 19)}]})
+                lines = response.data.decode().split("\n")
+        finally:
+            release.join()
+        self.assertIn("", lines[:-2])
+        self.assertIn("teams", json.loads(lines[-2])["result"])
+        self.assertEqual(self.wait_for_job(job["id"])["status"], "done")
+
+    def test_benchmark_generator_and_report(self):
+        fencers = benchmark.generate_entries(30, 0.2, "specialist", seed=3)
+        self.assertEqual(fencers, benchmark.generate_entries(30, 0.2, "specialist", seed=3))
+        self.assertEqual(len([f for f in fencers if f["category"] == "F"]), 6)
+        self.assertTrue(all(5 in f["preference"].values() for f in fencers))
+
+        runs = benchmark.run_benchmark([9], [0.5], ["random"], ["auto", "aggregated"], [0], 5000)
+        self.assertEqual([r["status"] for r in runs], ["OPTIMAL", "OPTIMAL"])
+        self.assertEqual(runs[0]["objective"], runs[1]["objective"])
+        self.assertGreater(runs[1]["variables"], 0)
+        self.assertGreater(runs[1]["peak_rss_mb"], 0)
+
+        slower = [dict(r, wall_ms=r["wall_ms"] * 10 + 100, objective=r["objective"] - 1) for r in runs]
+        regressions = benchmark.compare(slower, runs)
+        self.assertEqual(len(regressions), 2)
+        self.assertEqual(benchmark.compare(runs, runs), [])
+
+    def test_loadtest_harness(self):
+        self.assertEqual(loadtest.parse_mix(["12:3", "48:1:0.15", "24:1:0.5:holistic"]),
+                         [(12, 3.0, 0.4, "auto"), (48, 1.0, 0.15, "auto"), (24, 1.0, 0.5, "holistic")])
+        # The default mix puts part of the load on SCIP, not only on the flow fast path
+        default = loadtest.parse_mix(loadtest.DEFAULT_MIX)
+        self.assertTrue(any(entry[3] == "holistic" for entry in default))
+        self.assertTrue(any(classify_problem(benchmark.generate_entries(n, ratio)) == "holistic"
+                            for n, _, ratio, _ in default))
+        self.assertEqual([loadtest.percentile(list(range(1, 101)), q) for q in (50, 95, 99)], [50, 95, 99])
+        self.assertGreater(loadtest.process_rss_mb(os.getpid()), 0)
+
+        runs = loadtest.run_config("gthread", 1, 2, 0, [2], [(9, 1, 0.4, "auto"), (12, 1, 0.4, "holistic")], 4, 5000)
+        self.assertEqual(len(runs), 1)
+        self.assertEqual(runs[0]["errors"], 0)
+        self.assertGreater(runs[0]["throughput_rps"], 0)
+        self.assertLessEqual(runs[0]["p50_ms"], runs[0]["p99_ms"])
+        self.assertEqual(len(runs[0]["worker_rss_mb"]), 1)
+        self.assertGreater(runs[0]["milp_share"], 0)
+        self.assertEqual(loadtest.best_configs(runs), runs)
+
 if __name__ == '__main__':
     unittest.main()